@@ -0,0 +1,337 @@
+#!/usr/bin/python3
+# Basic block translator for Glacial microcode simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A block is a straight-line run of microinstructions, ending with (and
+# including) the first jump, call, br, skb, or opr with ret or addapc.
+# Each block is compiled into a single Python function that keeps the
+# accumulator, carry, X and Y in locals, and writes them back to the
+# simulator along with the new pc and cycle count when it returns.
+#
+# A block also ends before any opr that transmits on the UART or drives
+# SPI, since those need the cycle count to be exact at the time of the
+# microinstruction, and before any boundary address (breakpoints, and
+# the RISC-V instruction boundary used for trace and halt detection).
+# Those microinstructions are left to the interpreter, as are countdown
+# loops, which the interpreter runs in a single step, and when there are
+# memory watchpoints, any memory access that might hit one.
+#
+# A store that hits cached code invalidates the blocks using it, but the
+# block that made the store keeps running its compiled code, so if the
+# store may hit a later microinstruction of the same block, the block
+# returns right after the store instead.  Each of these early exits is
+# counted by the profiler as a shorter block.
+
+import copy
+
+from glacial import OT
+
+
+class BlockTranslator:
+
+    class TranslationMismatch(Exception):
+        pass
+
+    max_block_length = 64
+
+    # opr bits that need the interpreter
+    opr_untranslatable = 0x100 | 0x400 | 0x800  # uarttx, spidis/spien, spixfer
+
+    def __init__(self, sim, validate = False):
+        self.sim = sim
+        self.validate = validate
+        self.shadow = None
+        self.boundaries = set()
+        self.flush()
+
+    def flush(self):
+        self.blocks = [None] * self.sim.ucode_region_size
+        self.cover = { }  # address -> list of start addresses of blocks using it
+
+    def set_boundaries(self, boundaries):
+        if boundaries == self.boundaries:
+            return
+        self.boundaries = set(boundaries)
+        self.flush()
+
+    def invalidate(self, addr):
+        for start in self.cover.pop(addr, ()):
+            self.blocks[start] = None
+
+    @staticmethod
+    def __inc(reg):
+        if reg == 'x':
+            return 'x = (x + 1) & 0xff'
+        return 'y = (y + 1) & 0xffffffff'
+
+    def __operand(self, operand_class, fields):
+        if operand_class == OT.imm:
+            return [], '0x%02x' % fields['i']
+        if operand_class == OT.mem:
+            return [], 'mem[0x%02x]' % fields['m']
+        reg = 'xy'[fields['x']]
+        if operand_class == OT.ind:
+            return [], 'mem[%s]' % reg
+        return ['v = mem[%s]' % reg, self.__inc(reg)], 'v'
+
+    # The rest of the block, from npc, is within this range.  A line
+    # 'EXIT' is replaced by the code for an early exit from the block.
+    def __store(self, operand_class, fields, npc):
+        size = self.sim.ucode_region_size
+        rest = (npc, npc + 2 * self.max_block_length)
+        if operand_class == OT.mem:
+            addr = fields['m']
+            lines = ['mem[0x%02x] = a' % addr]
+            if rest[0] <= addr < rest[1]:
+                lines += ['if code_map[0x%02x]:' % addr,
+                          '    inv(0x%02x)' % addr,
+                          '    EXIT']
+            elif addr < size:
+                lines += ['if code_map[0x%02x]: inv(0x%02x)' % (addr, addr)]
+            return lines
+        reg = 'xy'[fields['x']]
+        if operand_class == OT.ind:
+            lines = []
+        else:
+            lines = ['v = ' + reg, self.__inc(reg)]
+            reg = 'v'
+        lines += ['mem[%s] = a' % reg]
+        if reg == 'x':
+            lines += ['if code_map[x]:']
+        else:
+            lines += ['if %s < %d and code_map[%s]:' % (reg, size, reg)]
+        lines += ['    inv(%s)' % reg]
+        if rest[0] <= (0xff if reg == 'x' else size - 1):
+            lines += ['    if 0x%04x <= %s < 0x%04x:' % (rest[0], reg, rest[1]),
+                      '        EXIT']
+        return lines
+
+    # Returns (lines, next pc expression or None if the block continues),
+    # or None if the microinstruction must be left to the interpreter.
+    def __translate(self, pc, mnem, operand_classes, fields):
+        if self.sim.watch_map is not None and self.sim.watch_access(mnem, operand_classes, fields):
+            return None
+        npc = pc + 2
+        if mnem in ['load', 'and', 'xor', 'adc']:
+            lines, operand = self.__operand(operand_classes[0], fields)
+            if mnem == 'load':
+                lines += ['a = ' + operand]
+            elif mnem == 'and':
+                lines += ['a &= ' + operand]
+            elif mnem == 'xor':
+                lines += ['a ^= ' + operand]
+            else:
+                lines += ['t = a + %s + c' % operand,
+                          'a = t & 0xff',
+                          'c = t >> 8']
+            return lines, None
+        if mnem == 'store':
+            return self.__store(operand_classes[0], fields, npc), None
+        if mnem == 'jump':
+            return [], '0x%04x' % fields['j']
+        if mnem == 'call':
+            return ['sim.return_address = 0x%04x' % npc], '0x%04x' % fields['j']
+        if mnem == 'br':
+            cond = ['a == 0',
+                    'c',
+                    'sim.ext_int_pending',
+                    'sim.tick_pending'][fields['c'] >> 1]
+            return (['npc = 0x%04x if (%s) == %d else 0x%04x' % (fields['j'], cond, fields['c'] & 1, npc)],
+                    'npc')
+        if mnem == 'skb':
+            lines, operand = self.__operand(operand_classes[0], fields)
+            lines += ['npc = 0x%04x if ((%s >> %d) & 1) == %d else 0x%04x' % (npc + 2, operand, fields['b'], fields['i'], npc)]
+            return lines, 'npc'
+        assert mnem == 'opr'
+        opr = fields['i']
+        if opr & self.opr_untranslatable:
+            return None
+        lines = []
+        next_pc = None
+        if opr & 0x002:  # tax, tay
+            if opr & 0x001 == 0:
+                lines += ['x = a']
+            else:
+                lines += ['y = (y >> 8) | (a << %d)' % (self.sim.address_width - 8)]
+        if opr & 0x008:  # sec, clc
+            lines += ['c = %d' % ((opr >> 2) & 1)]
+        if opr & 0x040:  # ret
+            lines += ['npc = sim.return_address']
+            next_pc = 'npc'
+        if opr & 0x020:  # rlc, rrc
+            if opr & 0x010 == 0:
+                lines += ['t = (a << 1) + c',
+                          'c = t >> 8',
+                          'a = t & 0xff']
+            else:
+                lines += ['t = a + (c << 8)',
+                          'c = t & 1',
+                          'a = t >> 1']
+        if opr & 0x080:  # addapc
+            if next_pc is None:
+                lines += ['npc = 0x%04x + 2 * a' % npc]
+            else:
+                lines += ['npc += 2 * a']
+            next_pc = 'npc'
+        if opr & 0x200:  # clrtick
+            lines += ['sim.tick_pending = 0']
+        return lines, next_pc
+
+    # Returns the lines that write back the state and end the block
+    # after count microinstructions, the last of which is ir.
+    def __exit(self, start, count, ir, next_pc):
+        lines = ['sim.accumulator = a',
+                 'sim.carry = c',
+                 'sim.x = x',
+                 'sim.y = y',
+                 'sim.ir = 0x%04x' % ir,
+                 'sim.pc = ' + next_pc,
+                 'sim.cycle += %d' % (4 * count)]
+        profiler = self.sim.profiler
+        if profiler is not None:
+            index = profiler.add_block(start, count)
+            lines += ['prof.block_counts[%d] += 1' % index,
+                      'prof.call_cycles[prof.call_site] += %d' % (4 * count)]
+        return lines
+
+    # Returns a (function, microinstruction count) tuple, or False if
+    # the microinstruction at start must be left to the interpreter.
+    # The count is that of the whole block, without early exits.
+    def compile(self, start):
+        sim = self.sim
+        size = sim.ucode_region_size
+        body = []
+        pc = start
+        count = 0
+        next_pc = None
+        while True:
+            if pc >= size - 1 or count >= self.max_block_length:
+                break
+            if count and pc in self.boundaries:
+                break
+            ir, mnem, handler, operand_classes, fields, arg = sim.decode(pc)
+            if handler == sim.inst_countdown_loop:
+                break
+            t = self.__translate(pc, mnem, operand_classes, fields)
+            if t is None:
+                break
+            lines, next_pc = t
+            body += ['# %04x: %04x %s' % (pc, ir, mnem)]
+            for l in lines:
+                if l.strip() == 'EXIT':
+                    indent = l[:len(l) - len(l.lstrip())]
+                    body += [indent + e for e in self.__exit(start, count + 1, ir, '0x%04x' % (pc + 2))]
+                    body += [indent + 'return']
+                else:
+                    body += [l]
+            last_ir = ir
+            last_mnem = mnem
+            last_arg = arg
+            pc += 2
+            count += 1
+            if next_pc is not None:
+                break
+        if count == 0:
+            return False
+        if next_pc is None:
+            next_pc = '0x%04x' % pc
+
+        src = ['def block(sim):',
+               '    a = sim.accumulator',
+               '    c = sim.carry',
+               '    x = sim.x',
+               '    y = sim.y']
+        src += ['    ' + l for l in body]
+        src += ['    ' + l for l in self.__exit(start, count, last_ir, next_pc)]
+        namespace = { 'mem':      sim.memory,
+                      'code_map': sim.code_map,
+                      'inv':      sim.invalidate_decode }
+        if sim.profiler is not None:
+            if last_mnem == 'call':
+                src += ['    prof.call_site = 0x%04x' % (pc - 2)]
+            elif last_mnem == 'opr' and last_arg & 0x040:  # ret
+                src += ['    prof.call_site = prof.no_call']
+            namespace['prof'] = sim.profiler
+        exec('\n'.join(src), namespace)
+
+        for addr in range(start, pc):
+            sim.code_map[addr] = 1
+            self.cover.setdefault(addr, []).append(start)
+        return namespace['block'], count
+
+    def execute(self):
+        sim = self.sim
+        pc = sim.pc
+        if pc >= sim.ucode_region_size or pc in self.boundaries:
+            block = False
+        else:
+            block = self.blocks[pc]
+            if block is None:
+                block = self.compile(pc)
+                self.blocks[pc] = block
+        if self.validate and self.shadow is None:
+            self.shadow = self.make_shadow()
+        cycle = sim.cycle
+        if block:
+            block[0](sim)
+        elif sim.profiler is not None:
+            sim.profiler.execute_single()
+        else:
+            sim.execute_single()
+        if self.validate:
+            # microinstructions run: less than block[1] after an early
+            # exit, and zero if halt detected
+            self.check_shadow(pc, (sim.cycle - cycle) // 4)
+
+    # The shadow is an interpreter-only copy of the simulator, without
+    # a UART but with its own copy of the SPI device state, that is
+    # stepped alongside the translated code.  It runs countdown loops
+    # one microinstruction at a time, so that they are checked too.
+    state_attrs = ['accumulator', 'carry', 'x', 'y', 'pc', 'return_address',
+                   'cycle', 'ext_int_pending', 'tick_pending']
+
+    # The simulator memory may be a Memory or similar wrapper, or a
+    # plain bytearray.
+    @staticmethod
+    def memory_bytes(memory):
+        return getattr(memory, 'data', memory)
+
+    def make_shadow(self):
+        sim = self.sim
+        shadow = type(sim)(arch = sim.arch,
+                           memory = bytearray(self.memory_bytes(sim.memory)),
+                           start_addr = sim.pc,
+                           address_width = sim.address_width,
+                           spi = copy.copy(sim.spi))
+        shadow.countdown_loops = False
+        for attr in self.state_attrs:
+            setattr(shadow, attr, getattr(sim, attr))
+        shadow.running = True
+        return shadow
+
+    def check_shadow(self, pc, count):
+        sim = self.sim
+        shadow = self.shadow
+        shadow.ext_int_pending = sim.ext_int_pending
+        shadow.tick_pending = sim.tick_pending
+        for i in range(count):
+            shadow.execute_single()
+        for attr in self.state_attrs:
+            if getattr(shadow, attr) != getattr(sim, attr):
+                raise BlockTranslator.TranslationMismatch('block at %04x: %s translated %x, interpreted %x' % (pc, attr, getattr(sim, attr), getattr(shadow, attr)))
+        data = self.memory_bytes(sim.memory)
+        if shadow.memory != data:
+            addr = next(i for i in range(len(data)) if shadow.memory[i] != data[i])
+            raise BlockTranslator.TranslationMismatch('block at %04x: memory %04x translated %02x, interpreted %02x' % (pc, addr, data[addr], shadow.memory[addr]))
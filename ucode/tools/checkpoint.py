@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# Checkpoint files for Glacial microcode simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A checkpoint file is a fixed little-endian header, followed by the
+# simulator registers and counters, the UART decoder state, and the
+# names of the ELF files loaded (for symbols), then the raw memory
+# image, and optionally the valid bitmap used for uninitialized read
+# detection.  The memory image and valid bitmap start on page
+# boundaries, so they can be memory-mapped or read directly into place
+# without any parsing.
+#
+# Pending events are not saved.  Periodic ones (xtick edges, and UART
+# receive polls while the line is idle) are scheduled again from the
+# command line options when the checkpoint is restored, but any other
+# event would be lost, so save() refuses with a StateError while one is
+# pending, for example in the middle of a received UART frame.
+
+import mmap
+import struct
+
+
+class Checkpoint:
+
+    class FormatError(Exception):
+        pass
+
+    class StateError(Exception):
+        pass
+
+    magic = b'GLACIALC'
+    version = 4
+
+    # magic, version, memory size, memory offset, valid bitmap offset
+    # (zero if absent), UART state size (zero if no UART), ELF file
+    # names size
+    header_struct = struct.Struct('<8sIIIIII')
+
+    # accumulator, carry, x, y, pc, return_address, cycle,
+    # ext_int_line, tick_pending, prev_mpc valid, prev_mpc (the halt
+    # detection state).  The UART receive line is always idle (high) when
+    # a checkpoint is saved, so only the --ext-int source of xint is kept.
+    # Then the counters riscv_insts and uart_bytes.
+    sim_struct = struct.Struct('<BBBIIIQBBBIQQ')
+
+    page_size = mmap.ALLOCATIONGRANULARITY
+
+    def __init__(self):
+        self.memory = None
+        self.valid = None
+        self.sim_state = None
+        self.uart_state = None
+        self.elf_names = [ ]
+
+    @classmethod
+    def _align(cls, offset):
+        return (offset + cls.page_size - 1) & ~(cls.page_size - 1)
+
+    # The simulator memory may be a Memory, an UninitializedReadDetector,
+    # or a plain bytearray.  elf_names are the paths of the ELF files
+    # loaded, which are read again for their symbols on restoring.
+    @staticmethod
+    def save(f, sim, elf_names = ()):
+        if sim.events.one_shot_pending():
+            raise Checkpoint.StateError('events are pending that would be lost')
+        memory = getattr(sim.memory, 'data', sim.memory)
+        valid = getattr(sim.memory, 'valid', None)
+        if sim.uart is None:
+            uart_state = b''
+        else:
+            uart_state = sim.uart.get_state()
+        names = '\n'.join(elf_names).encode('utf-8')
+
+        hs = Checkpoint.header_struct.size
+        mem_offset = Checkpoint._align(hs + Checkpoint.sim_struct.size + len(uart_state) + len(names))
+        if valid is None:
+            valid_offset = 0
+        else:
+            valid_offset = Checkpoint._align(mem_offset + len(memory))
+
+        f.write(Checkpoint.header_struct.pack(Checkpoint.magic,
+                                              Checkpoint.version,
+                                              len(memory),
+                                              mem_offset,
+                                              valid_offset,
+                                              len(uart_state),
+                                              len(names)))
+        f.write(Checkpoint.sim_struct.pack(sim.accumulator,
+                                           sim.carry,
+                                           sim.x,
+                                           sim.y,
+                                           sim.pc,
+                                           sim.return_address,
+                                           sim.cycle,
+                                           sim.ext_int_line,
+                                           sim.tick_pending,
+                                           sim.prev_mpc is not None,
+                                           sim.prev_mpc or 0,
+                                           sim.riscv_insts,
+                                           sim.uart_bytes))
+        f.write(uart_state)
+        f.write(names)
+        f.seek(mem_offset)
+        f.write(memory)
+        if valid is not None:
+            f.seek(valid_offset)
+            f.write(valid)
+
+    # Reads the memory image (and valid bitmap, if present) into
+    # bytearrays with readinto(), so that the simulator doesn't pay for
+    # memory-mapped accesses in its inner loop.
+    @staticmethod
+    def load(f):
+        cp = Checkpoint()
+        header = f.read(Checkpoint.header_struct.size)
+        if len(header) != Checkpoint.header_struct.size:
+            raise Checkpoint.FormatError('truncated header')
+        (magic, version, mem_size, mem_offset, valid_offset, uart_size, names_size) = Checkpoint.header_struct.unpack(header)
+        if magic != Checkpoint.magic:
+            raise Checkpoint.FormatError('not a checkpoint file')
+        if version != Checkpoint.version:
+            raise Checkpoint.FormatError('unsupported checkpoint version %d' % version)
+        cp.sim_state = Checkpoint.sim_struct.unpack(f.read(Checkpoint.sim_struct.size))
+        if uart_size:
+            cp.uart_state = f.read(uart_size)
+        if names_size:
+            cp.elf_names = f.read(names_size).decode('utf-8').split('\n')
+
+        cp.memory = bytearray(mem_size)
+        f.seek(mem_offset)
+        if f.readinto(cp.memory) != mem_size:
+            raise Checkpoint.FormatError('truncated memory image')
+        if valid_offset:
+            cp.valid = bytearray(mem_size)
+            f.seek(valid_offset)
+            if f.readinto(cp.valid) != mem_size:
+                raise Checkpoint.FormatError('truncated valid bitmap')
+        return cp
+
+    # Restores the registers, counters and UART state.  The simulator memory must
+    # already have been set to the checkpoint memory.
+    def apply(self, sim):
+        (sim.accumulator,
+         sim.carry,
+         sim.x,
+         sim.y,
+         sim.pc,
+         sim.return_address,
+         sim.cycle,
+         sim.ext_int_line,
+         sim.tick_pending,
+         prev_mpc_valid,
+         prev_mpc,
+         sim.riscv_insts,
+         sim.uart_bytes) = self.sim_state
+        sim.rx_line_low = 0
+        sim.update_xint()
+        sim.prev_mpc = prev_mpc if prev_mpc_valid else None
+        if self.uart_state is not None and sim.uart is not None:
+            if len(self.uart_state) != sim.uart.state_struct.size:
+                raise Checkpoint.FormatError('UART state size mismatch')
+            sim.uart.set_state(self.uart_state)
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# Console output for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Collects the bytes received from the simulated UART into lines, and
+# writes each complete line to every sink: text files, or memory
+# buffers returned by add_buffer().  Sinks are only flushed at the end
+# of a line if asked to (for a terminal), otherwise at flush(), which
+# the simulator calls when it stops; flush() also writes out a partial
+# last line.  A sink can prefix each line with the cycle at which its
+# first byte was received.  Bytes are taken as Latin-1 characters.
+
+import io
+
+
+class Console:
+
+    def __init__(self):
+        self.sinks = [ ]  # (file, timestamps, flush_lines)
+        self.line = [ ]
+        self.line_cycle = 0
+        self.continued = False  # the start of the line was written by flush()
+
+    def add_file(self, f, timestamps = False, flush_lines = False):
+        self.sinks.append((f, timestamps, flush_lines))
+
+    def add_buffer(self, timestamps = False):
+        buffer = io.StringIO()
+        self.add_file(buffer, timestamps)
+        return buffer
+
+    def write(self, cycle, b):
+        if not self.line:
+            self.line_cycle = cycle
+        self.line.append(chr(b))
+        if b == 0x0a:
+            self.write_line()
+            self.continued = False
+
+    def write_line(self):
+        text = ''.join(self.line)
+        self.line = [ ]
+        for f, timestamps, flush_lines in self.sinks:
+            if timestamps and not self.continued:
+                f.write('%12d: ' % self.line_cycle)
+            f.write(text)
+            if flush_lines:
+                f.flush()
+
+    def flush(self):
+        if self.line:
+            self.write_line()
+            self.continued = True
+        for f, timestamps, flush_lines in self.sinks:
+            f.flush()
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# Microcode coverage for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A coverage file is a header followed by one byte of flags per
+# microcode address.  A br is taken when it goes to its target, and an
+# skb is taken when it skips; a microinstruction that is executed but
+# never taken has the not_taken flag.  Only the flags are kept, not the
+# counts, so that files from any number of runs can be merged by
+# counting the runs that set each flag (see covmerge).
+#
+# A merged coverage file keeps those counts, and the number of runs, so
+# that it can be merged again: a header with the number of runs, then
+# for each of executed, taken and not_taken, a little-endian 32-bit
+# count per microcode address.
+#
+# The interpreter step is sim.execute_single, or another step wrapping
+# it, such as the profiler's, set in step.
+
+import array
+import struct
+import sys
+
+
+class Coverage:
+
+    class FormatError(Exception):
+        pass
+
+    magic = b'GLCOVER1'
+    header_struct = struct.Struct('<8sI')  # magic, microcode region size
+
+    merged_magic = b'GLCOVERM'
+    runs_struct = struct.Struct('<I')  # follows the header of a merged file
+
+    executed =  0x01
+    taken =     0x02
+    not_taken = 0x04
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.flags = bytearray(sim.ucode_region_size)
+        self.step = sim.execute_single
+
+    # Executes one microinstruction with the interpreter and records it.
+    # A countdown loop covers its three microinstructions, with the br
+    # taken on all but the last iteration.
+    def execute_single(self):
+        sim = self.sim
+        pc = sim.pc
+        flags = self.flags
+        if pc >= len(flags):
+            self.step()
+            return
+        entry = sim.decode_cache[pc]
+        if entry is None:
+            entry = sim.decode(pc)
+        cycle = sim.cycle
+        self.step()
+        cycles = sim.cycle - cycle
+        if not cycles:
+            return  # halt detected
+        if cycles > 4:
+            flags[pc] |= self.executed
+            flags[pc + 2] |= self.executed
+            if cycles > 12:
+                flags[pc + 4] |= self.executed | self.taken | self.not_taken
+            else:
+                flags[pc + 4] |= self.executed | self.not_taken
+            return
+        mnem = entry[1]
+        if mnem == 'br':
+            if sim.pc == pc + 2:
+                flags[pc] |= self.executed | self.not_taken
+            else:
+                flags[pc] |= self.executed | self.taken
+        elif mnem == 'skb':
+            if sim.pc == pc + 4:
+                flags[pc] |= self.executed | self.taken
+            else:
+                flags[pc] |= self.executed | self.not_taken
+        else:
+            flags[pc] |= self.executed
+
+    def write(self, f):
+        f.write(self.header_struct.pack(self.magic, len(self.flags)))
+        f.write(self.flags)
+
+    # Returns the flags from a coverage file.
+    @staticmethod
+    def read(f):
+        header = f.read(Coverage.header_struct.size)
+        if len(header) != Coverage.header_struct.size:
+            raise Coverage.FormatError('truncated header')
+        magic, size = Coverage.header_struct.unpack(header)
+        if magic != Coverage.magic:
+            raise Coverage.FormatError('not a coverage file')
+        flags = f.read(size)
+        if len(flags) != size:
+            raise Coverage.FormatError('truncated coverage file')
+        return flags
+
+    # Returns (runs, counts) from a coverage file or a merged one, where
+    # counts is a list of arrays of the number of runs that set the
+    # executed, taken and not_taken flags at each address.
+    @staticmethod
+    def read_counts(f):
+        header = f.read(Coverage.header_struct.size)
+        if len(header) != Coverage.header_struct.size:
+            raise Coverage.FormatError('truncated header')
+        magic, size = Coverage.header_struct.unpack(header)
+        if magic == Coverage.magic:
+            flags = f.read(size)
+            if len(flags) != size:
+                raise Coverage.FormatError('truncated coverage file')
+            counts = [array.array('I', (1 if v & flag else 0 for v in flags))
+                      for flag in (Coverage.executed, Coverage.taken, Coverage.not_taken)]
+            return 1, counts
+        if magic != Coverage.merged_magic:
+            raise Coverage.FormatError('not a coverage file')
+        runs_data = f.read(Coverage.runs_struct.size)
+        if len(runs_data) != Coverage.runs_struct.size:
+            raise Coverage.FormatError('truncated header')
+        runs, = Coverage.runs_struct.unpack(runs_data)
+        counts = [ ]
+        for i in range(3):
+            a = array.array('I')
+            try:
+                a.fromfile(f, size)
+            except EOFError:
+                raise Coverage.FormatError('truncated coverage file')
+            if sys.byteorder != 'little':
+                a.byteswap()
+            counts.append(a)
+        return runs, counts
+
+    @staticmethod
+    def write_counts(f, runs, counts):
+        f.write(Coverage.header_struct.pack(Coverage.merged_magic, len(counts[0])))
+        f.write(Coverage.runs_struct.pack(runs))
+        for a in counts:
+            if sys.byteorder != 'little':
+                a = array.array('I', a)
+                a.byteswap()
+            a.tofile(f)
@@ -14,12 +14,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import bisect
 from collections import OrderedDict
 import mmap
 import struct
 import sys
 
-from elfdefs import ET, EM, PT
+from elfdefs import ET, EM, PT, SHT, SHN, STB, STT
 
 
 field_char = { 1: 'B',
@@ -112,6 +113,42 @@ class ProgHeader:
         return 'ProgHeader(' + ', '.join(['%s=%0*x' % (name, size*2, getattr(self, name)) for (name, size) in self.fields.items()]) + ')'
 
 
+class SectionHeader:
+    def __init__(self, data, offset, endian, width):
+        self.fields = OrderedDict([('sh_name', 4),
+                                   ('sh_type', 4),
+                                   ('sh_flags', width // 8),
+                                   ('sh_addr', width // 8),
+                                   ('sh_offset', width // 8),
+                                   ('sh_size', width // 8),
+                                   ('sh_link', 4),
+                                   ('sh_info', 4),
+                                   ('sh_addralign', width // 8),
+                                   ('sh_entsize', width // 8)])
+        for name, size in self.fields.items():
+            v = struct.unpack_from(endian + field_char[size], data, offset)[0]
+            setattr(self, name, v)
+            offset += size
+        self.name = None
+
+    def __str__(self):
+        return 'SectionHeader(' + ', '.join(['%s=%0*x' % (name, size*2, getattr(self, name)) for (name, size) in self.fields.items()]) + ')'
+
+
+class ElfSymbol:
+    def __init__(self, name, value, size, info, other, shndx):
+        self.name = name
+        self.value = value
+        self.size = size
+        self.bind = info >> 4
+        self.type = info & 0x0f
+        self.other = other
+        self.shndx = shndx
+
+    def __str__(self):
+        return 'ElfSymbol(%s, value=%x, size=%d, bind=%d, type=%d, shndx=%d)' % (self.name, self.value, self.size, self.bind, self.type, self.shndx)
+
+
 class ElfSegment:
     def __init__(self, data, prog_header):
         self.prog_header = prog_header
@@ -127,6 +164,8 @@ class ElfFile:
     def parse_headers(self):
         elf_file_ident = ElfFileIdentHeader(self.data)
         elf_file_header = ElfFileHeader(self.data, elf_file_ident.endian, elf_file_ident.width)
+        self.ident = elf_file_ident
+        self.header = elf_file_header
 
         if elf_file_header.e_type != ET.ET_EXEC:
             raise ElfError('Not an executable ELF file')
@@ -161,6 +200,9 @@ class ElfFile:
                               access = mmap.ACCESS_READ)
         self.debug = debug
         self.parse_headers()
+        self.__section_headers = None
+        self.__symbols = None
+        self.__symbol_index = None
 
     def find_segment(self, addr):
         for segment in self.segments:
@@ -168,6 +210,111 @@ class ElfFile:
                 return segment
         return None
 
+    def get_string(self, section_header, offset):
+        start = section_header.sh_offset + offset
+        end = self.data.find(b'\0', start, section_header.sh_offset + section_header.sh_size)
+        if end < 0:
+            raise ElfError('Unterminated string in string table')
+        return self.data[start:end].decode('utf-8', errors = 'replace')
+
+    # Section headers, symbols and the symbol address index are only
+    # parsed when first used.
+    @property
+    def section_headers(self):
+        if self.__section_headers is None:
+            header = self.header
+            endian = self.ident.endian
+            width = self.ident.width
+            shs = []
+            for sh_index in range(header.e_shnum):
+                sh_offset = header.e_shoff + sh_index * header.e_shentsize
+                shs.append(SectionHeader(self.data, sh_offset, endian, width))
+            if header.e_shstrndx != SHN.SHN_UNDEF and header.e_shstrndx < len(shs):
+                shstrtab = shs[header.e_shstrndx]
+                for sh in shs:
+                    sh.name = self.get_string(shstrtab, sh.sh_name)
+            self.__section_headers = shs
+        return self.__section_headers
+
+    def find_section(self, name):
+        for sh in self.section_headers:
+            if sh.name == name:
+                return sh
+        return None
+
+    @property
+    def symbols(self):
+        if self.__symbols is None:
+            self.__symbols = []
+            for sh in self.section_headers:
+                if sh.sh_type != SHT.SHT_SYMTAB:
+                    continue
+                strtab = self.section_headers[sh.sh_link]
+                if self.ident.width == 32:
+                    fmt = self.ident.endian + 'IIIBBH'
+                else:
+                    fmt = self.ident.endian + 'IBBHQQ'
+                entsize = struct.calcsize(fmt)
+                if sh.sh_entsize != entsize:
+                    raise ElfError('Unexpected symbol table entry size %d' % sh.sh_entsize)
+                data = self.data[sh.sh_offset:sh.sh_offset + sh.sh_size]
+                for fields in struct.iter_unpack(fmt, data):
+                    if self.ident.width == 32:
+                        st_name, st_value, st_size, st_info, st_other, st_shndx = fields
+                    else:
+                        st_name, st_info, st_other, st_shndx, st_value, st_size = fields
+                    name = self.get_string(strtab, st_name) if st_name else ''
+                    self.__symbols.append(ElfSymbol(name, st_value, st_size, st_info, st_other, st_shndx))
+        return self.__symbols
+
+    # The address index holds the defined function, object and untyped
+    # symbols, other than local assembler labels, sorted by address.
+    # Where several share an address, functions are preferred over other
+    # types, and global over local symbols.
+    @staticmethod
+    def __symbol_rank(sym):
+        return (sym.type == STT.STT_FUNC,
+                sym.bind != STB.STB_LOCAL,
+                sym.type != STT.STT_NOTYPE)
+
+    def __build_symbol_index(self):
+        by_addr = { }
+        for sym in self.symbols:
+            if sym.type not in (STT.STT_NOTYPE, STT.STT_OBJECT, STT.STT_FUNC):
+                continue
+            if sym.shndx == SHN.SHN_UNDEF or not sym.name:
+                continue
+            if sym.name.startswith('.L') or sym.name.startswith('$'):
+                continue
+            prev = by_addr.get(sym.value)
+            if prev is None or self.__symbol_rank(sym) > self.__symbol_rank(prev):
+                by_addr[sym.value] = sym
+        self.__symbol_addrs = sorted(by_addr)
+        self.__symbol_index = [by_addr[addr] for addr in self.__symbol_addrs]
+
+    # Returns (symbol, offset) for the symbol at or nearest below addr,
+    # or (None, None) if there is none, or addr is past the end of a
+    # symbol with a nonzero size.
+    def lookup(self, addr):
+        if self.__symbol_index is None:
+            self.__build_symbol_index()
+        i = bisect.bisect_right(self.__symbol_addrs, addr)
+        if i == 0:
+            return None, None
+        sym = self.__symbol_index[i-1]
+        offset = addr - sym.value
+        if sym.size and offset >= sym.size:
+            return None, None
+        return sym, offset
+
+    def format_addr(self, addr):
+        sym, offset = self.lookup(addr)
+        if sym is None:
+            return '%08x' % addr
+        if offset == 0:
+            return sym.name
+        return '%s+0x%x' % (sym.name, offset)
+
 
 if __name__ == '__main__':
 
@@ -180,3 +327,7 @@ if __name__ == '__main__':
     args = parser.parse_args ()
 
     elf = ElfFile(args.elffile, debug = True)
+    for sh in elf.section_headers:
+        print(sh.name, sh)
+    for sym in elf.symbols:
+        print(sym)
@@ -229,3 +229,47 @@ class PT(IntEnum):
     PT_HIPROC  = 0x7fffffff
 
 
+
+class SHT(IntEnum):
+    SHT_NULL          = 0x00000000
+    SHT_PROGBITS      = 0x00000001
+    SHT_SYMTAB        = 0x00000002
+    SHT_STRTAB        = 0x00000003
+    SHT_RELA          = 0x00000004
+    SHT_HASH          = 0x00000005
+    SHT_DYNAMIC       = 0x00000006
+    SHT_NOTE          = 0x00000007
+    SHT_NOBITS        = 0x00000008
+    SHT_REL           = 0x00000009
+    SHT_SHLIB         = 0x0000000a
+    SHT_DYNSYM        = 0x0000000b
+    SHT_INIT_ARRAY    = 0x0000000e
+    SHT_FINI_ARRAY    = 0x0000000f
+    SHT_PREINIT_ARRAY = 0x00000010
+    SHT_GROUP         = 0x00000011
+    SHT_SYMTAB_SHNDX  = 0x00000012
+    SHT_LOOS          = 0x60000000
+    SHT_HIOS          = 0x6fffffff
+    SHT_LOPROC        = 0x70000000
+    SHT_HIPROC        = 0x7fffffff
+
+class SHN(IntEnum):
+    SHN_UNDEF  = 0x0000
+    SHN_LORESERVE = 0xff00
+    SHN_ABS    = 0xfff1
+    SHN_COMMON = 0xfff2
+    SHN_XINDEX = 0xffff
+
+class STB(IntEnum):
+    STB_LOCAL  = 0
+    STB_GLOBAL = 1
+    STB_WEAK   = 2
+
+class STT(IntEnum):
+    STT_NOTYPE  = 0
+    STT_OBJECT  = 1
+    STT_FUNC    = 2
+    STT_SECTION = 3
+    STT_FILE    = 4
+    STT_COMMON  = 5
+    STT_TLS     = 6
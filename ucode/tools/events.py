@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# Event scheduler for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Peripherals schedule callbacks at cycle counts in a heap, and the
+# simulator keeps the cycle of the earliest one in next_event, so that
+# its main loop only compares the cycle counter against that.  Events
+# are dispatched between microinstructions (or translated blocks), so
+# one may be seen by the microcode a few cycles after its scheduled
+# cycle.  Each callback is passed its scheduled cycle, so that periodic
+# events don't drift.
+#
+# An event is periodic if it is one of a series that will be scheduled
+# again from the command line options on restoring a checkpoint, such as
+# the xtick edges.  Other events would be lost by a checkpoint, so one
+# can only be saved while none are pending.
+#
+# A signal handler can't safely schedule an event, since it may run in
+# the middle of a heap operation, so it posts a callback instead, which
+# is run at the next dispatch, at whatever cycle that is.  Posting sets
+# next_event to zero, and anything that recomputes next_event leaves it
+# at zero while posted callbacks are waiting.
+
+import heapq
+
+
+class EventQueue:
+
+    never = 1 << 64
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.heap = [ ]
+        self.seq = 0  # keeps events at the same cycle in scheduling order
+        self.posted = [ ]
+        sim.next_event = self.never
+
+    def update_next_event(self):
+        self.sim.next_event = self.heap[0][0] if self.heap else self.never
+        if self.posted:
+            self.sim.next_event = 0
+
+    def schedule(self, cycle, callback, periodic = False):
+        heapq.heappush(self.heap, (cycle, self.seq, callback, periodic))
+        self.seq += 1
+        self.update_next_event()
+
+    def cancel(self, callback):
+        self.heap[:] = [event for event in self.heap if event[2] is not callback]
+        heapq.heapify(self.heap)
+        self.update_next_event()
+
+    # Safe to call from a signal handler.
+    def post(self, callback):
+        self.posted.append(callback)
+        self.sim.next_event = 0
+
+    def dispatch(self):
+        sim = self.sim
+        heap = self.heap
+        while self.posted:
+            self.posted.pop(0)(sim.cycle)
+        while heap and heap[0][0] <= sim.cycle:
+            cycle, seq, callback, periodic = heapq.heappop(heap)
+            callback(cycle)
+        self.update_next_event()
+
+    # Returns True if any pending event is not periodic.
+    def one_shot_pending(self):
+        return any(not event[3] for event in self.heap)
+
+    # Rising edges of the xtick input, every period cycles starting at
+    # first, each of which sets the tick flag until the microcode
+    # clears it with clrtick.
+    def add_tick(self, period, first = None):
+        def tick(cycle):
+            self.sim.tick_pending = 1
+            self.schedule(cycle + period, tick, periodic = True)
+        self.schedule(period if first is None else first, tick, periodic = True)
+
+    # The xint input, asserted at cycle first and, if last is given,
+    # negated at cycle last.
+    def add_ext_int(self, first, last = None):
+        def assert_int(cycle):
+            self.sim.ext_int_line = 1
+            self.sim.update_xint()
+        def negate_int(cycle):
+            self.sim.ext_int_line = 0
+            self.sim.update_xint()
+        self.schedule(first, assert_int)
+        if last is not None:
+            self.schedule(last, negate_int)
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+# Flight recorder for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Keeps the last steps of the simulator loop (single microinstructions,
+# translated blocks, and countdown loops) and the last RISC-V
+# instructions executed, in preallocated circular buffers.  The recorder
+# wraps the step that run() would otherwise use, so the translator and
+# countdown loops stay in use, and records only the pc and cycle at the
+# start of each step; the microinstructions of a step follow from its
+# length in cycles, and are disassembled from memory when dumped.
+# Nothing is written until trigger() is called with one of the enabled
+# trigger conditions:
+#     breakpoint   simulation stopped at a breakpoint
+#     trap         the microcode reached its trap entry
+#     framing      the UART decoder saw a framing error
+#     halt         halt detection stopped the simulation
+#     watchpoint   a memory watchpoint was hit
+# The trap trigger is checked by the recorder itself, after the step
+# for the trap entry, which the simulator keeps as a translator
+# boundary so that it always starts a step.
+
+import array
+
+from profiler import RiscvProfiler
+
+
+class FlightRecorder:
+
+    trigger_names = ['breakpoint', 'trap', 'framing', 'halt', 'watchpoint']
+
+    def __init__(self, sim, f, length = 1024, riscv_length = 64, triggers = trigger_names,
+                 listing = None, elf_files = []):
+        self.sim = sim
+        self.f = f
+        self.triggers = set(triggers)
+        if 'trap' in self.triggers:
+            self.trap_addr = sim.trap
+        else:
+            self.trap_addr = None
+        self.listing = listing
+        self.elf_files = elf_files
+        self.step = sim.execute_single
+
+        # pc and cycle at the start of each step
+        self.pcs = array.array('I', bytes(4 * length))
+        self.cycles = array.array('Q', bytes(8 * length))
+        self.index = 0
+        self.wrapped = False
+        self.special = { sim.riscv_boundary, self.trap_addr }
+
+        # Each RISC-V entry is the pc and ir of an instruction, and the
+        # cycle at which the microcode started it.
+        self.riscv_pc = array.array('I', bytes(4 * riscv_length))
+        self.riscv_ir = array.array('I', bytes(4 * riscv_length))
+        self.riscv_cycle = array.array('Q', bytes(8 * riscv_length))
+        self.riscv_index = 0
+        self.riscv_count = 0
+        self.prev_pc = None
+        self.prev_cycle = None
+
+    def execute(self):
+        sim = self.sim
+        pc = sim.pc
+        i = self.index
+        self.pcs[i] = pc
+        self.cycles[i] = sim.cycle
+        i += 1
+        if i == len(self.pcs):
+            i = 0
+            self.wrapped = True
+        self.index = i
+        if pc not in self.special:
+            self.step()
+            return
+        if pc == sim.riscv_boundary:
+            self.boundary(sim)
+        self.step()
+        if pc == self.trap_addr:
+            self.dump('trap')
+
+    # As for RiscvProfiler, the instruction register at a boundary is
+    # that of the instruction started at the previous boundary.
+    def boundary(self, sim):
+        pc = sim.get_u32(0xc8)
+        if self.prev_pc is not None:
+            i = self.riscv_index
+            self.riscv_pc[i] = self.prev_pc
+            self.riscv_ir[i] = sim.get_u32(0xcc)
+            self.riscv_cycle[i] = self.prev_cycle
+            i += 1
+            if i == len(self.riscv_pc):
+                i = 0
+            self.riscv_index = i
+            self.riscv_count = min(self.riscv_count + 1, len(self.riscv_pc))
+        self.prev_pc = pc
+        self.prev_cycle = sim.cycle
+
+    # Returns (pc, cycle, microinstructions) for the steps, oldest
+    # first.  The last step is cut short, with zero microinstructions,
+    # if a trigger fired during it.
+    def steps(self):
+        n = len(self.pcs)
+        if self.wrapped:
+            order = list(range(self.index, n)) + list(range(self.index))
+        else:
+            order = list(range(self.index))
+        ends = [self.cycles[i] for i in order[1:]] + [self.sim.cycle]
+        for i, end in zip(order, ends):
+            yield self.pcs[i], self.cycles[i], (end - self.cycles[i]) // 4
+
+    def format_inst(self, cycle, pc):
+        ir, mnem, handler, operand_classes, fields, arg = self.sim.decode(pc)
+        s = '%10d %04x: %04x %s %s %s' % (cycle, pc, ir, mnem, operand_classes, fields)
+        if self.listing is not None:
+            s += '  ; ' + self.listing.format_addr(pc)
+        return s
+
+    def trigger(self, reason):
+        if reason in self.triggers:
+            self.dump(reason)
+
+    # Microinstructions are disassembled from memory as it is now, which
+    # differs from what was executed only for self-modified microcode.
+    def dump(self, reason):
+        f = self.f
+        sim = self.sim
+        print('flight recorder: %s at cycle %d' % (reason, sim.cycle), file = f)
+        n = len(self.riscv_pc)
+        for j in range(self.riscv_count):
+            i = (self.riscv_index - self.riscv_count + j) % n
+            ir = self.riscv_ir[i]
+            symbol = RiscvProfiler.symbolize(self.riscv_pc[i], self.elf_files)
+            print('%10d %08x: %08x %-11s %s' % (self.riscv_cycle[i], self.riscv_pc[i], ir,
+                                                 RiscvProfiler.classify(ir)[1], symbol or ''), file = f)
+        if self.prev_pc is not None:
+            print('%10d %08x: (in progress)' % (self.prev_cycle, self.prev_pc), file = f)
+        for pc, cycle, count in self.steps():
+            if count == 0:
+                print(self.format_inst(cycle, pc) + '  (in progress)', file = f)
+            elif count > 1 and sim.decode(pc)[2] == sim.inst_countdown_loop:
+                print(self.format_inst(cycle, pc) + '  (countdown loop, %d microinstructions)' % count, file = f)
+            else:
+                for j in range(count):
+                    print(self.format_inst(cycle + 4 * j, pc + 2 * j), file = f)
+        f.flush()
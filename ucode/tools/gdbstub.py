@@ -0,0 +1,306 @@
+#!/usr/bin/python3
+# GDB remote serial protocol stub for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Presents the RISC-V architectural state to GDB: x0..x31 and pc from
+# page zero, and RISC-V memory offset by riscv_mem_offset.  The
+# simulator is only stopped at loop3, between RISC-V instructions,
+# where pc holds the next instruction to execute.  Continue runs
+# run() with the RISC-V breakpoints set, so the hot loop is
+# unchanged; a thread watches the connection for an interrupt (^C)
+# from GDB meanwhile, and stops the simulator if one arrives.
+
+import os
+import select
+import socket
+import threading
+
+
+class GdbStub:
+
+    pc_addr = 0xc8
+    nextpc_addr = 0x80
+    reg_count = 33  # x0..x31, pc
+
+    sigint = 2
+    sigtrap = 5
+
+    target_xml = ('<?xml version="1.0"?>'
+                  '<!DOCTYPE target SYSTEM "gdb-target.dtd">'
+                  '<target version="1.0">'
+                  '<architecture>riscv:rv32</architecture>'
+                  '<feature name="org.gnu.gdb.riscv.cpu">' +
+                  ''.join('<reg name="x%d" bitsize="32" regnum="%d"/>' % (i, i) for i in range(32)) +
+                  '<reg name="pc" bitsize="32" type="code_ptr" regnum="32"/>'
+                  '</feature>'
+                  '</target>')
+
+    # address is 'unix:PATH', 'HOST:PORT' or 'PORT'
+    def __init__(self, sim, address):
+        self.sim = sim
+        if address.startswith('unix:'):
+            path = address[5:]
+            if os.path.exists(path):
+                os.unlink(path)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(path)
+        else:
+            host, sep, port = address.rpartition(':')
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind((host or 'localhost', int(port)))
+        self.listener.listen(1)
+        self.conn = None
+        self.buffer = b''
+        self.interrupted = False
+
+    def riscv_mem_offset(self):
+        return self.sim.get_u16(0x0002)
+
+    # Stop reasons for which the program has finished.
+    exit_reasons = ('halt', 'eot')
+
+    # Runs one microinstruction, after any events that are due, as run()
+    # would.  Returns False if the program finished.
+    def step_micro(self):
+        sim = self.sim
+        sim.running = True
+        sim.stop_reason = None
+        if sim.cycle >= sim.next_event:
+            sim.events.dispatch()
+        sim.execute_single()
+        return sim.stop_reason not in self.exit_reasons
+
+    # Runs microinstructions until the simulator is between RISC-V
+    # instructions, at loop3, through any watchpoints on the way.
+    # Returns False if the program finished first.
+    def run_to_loop3(self):
+        sim = self.sim
+        while sim.pc != sim.loop3:
+            if not self.step_micro():
+                return False
+        return True
+
+    def step(self):
+        return self.step_micro() and self.run_to_loop3()
+
+    # While the simulator runs, a ^C from GDB stops it.  The run flag
+    # is cleared again until the simulator has stopped, in case
+    # run() had not yet started.
+    def watch_for_interrupt(self, done):
+        while not done.is_set():
+            if self.interrupted:
+                self.sim.running = False
+            r, w, x = select.select([self.conn], [], [], 0.1)
+            if r:
+                data = self.conn.recv(1)
+                if not data:
+                    self.interrupted = True
+                    self.sim.running = False
+                    return
+                if data == b'\x03':
+                    self.interrupted = True
+                    self.sim.running = False
+
+    # Returns the signal for the stop reply, or None if the program
+    # finished.
+    def cont(self):
+        sim = self.sim
+        self.interrupted = False
+        done = threading.Event()
+        watcher = threading.Thread(target = self.watch_for_interrupt, args = (done,), daemon = True)
+        watcher.start()
+        stop = sim.run()  # steps off a breakpoint at loop3
+        done.set()
+        watcher.join()
+        if stop.reason in self.exit_reasons:
+            return None
+        if self.interrupted:
+            signal = self.sigint
+        elif stop.reason in ('breakpoint', 'watchpoint'):
+            signal = self.sigtrap
+        else:
+            return None
+        # An interrupt or watchpoint can stop the microcode anywhere.
+        if not self.run_to_loop3():
+            return None
+        return signal
+
+    def stop_reply(self, signal):
+        if signal is None:
+            return 'W00'
+        return 'S%02x' % signal
+
+    # RISC-V memory
+
+    def read_memory(self, addr, length):
+        offset = self.riscv_mem_offset()
+        memory = self.sim.memory
+        data = bytearray()
+        for i in range(length):
+            gaddr = ((addr + i) & 0xffff) + offset
+            if gaddr >= len(memory):
+                raise IndexError(gaddr)
+            data.append(memory[gaddr])
+        return data
+
+    def write_memory(self, addr, data):
+        offset = self.riscv_mem_offset()
+        sim = self.sim
+        for i, b in enumerate(data):
+            gaddr = ((addr + i) & 0xffff) + offset
+            if gaddr >= len(sim.memory):
+                raise IndexError(gaddr)
+            sim.memory[gaddr] = b
+            sim.invalidate_code(gaddr)
+
+    # registers
+
+    def read_register(self, n):
+        if n == 0:
+            return 0
+        if n < 32:
+            return self.sim.get_u32(4 * n)
+        return self.sim.get_u32(self.pc_addr)
+
+    def write_register(self, n, value):
+        if n == 0:
+            return
+        if n < 32:
+            addrs = [4 * n]
+        else:
+            addrs = [self.pc_addr, self.nextpc_addr]
+        for addr in addrs:
+            for i in range(4):
+                self.sim.memory[addr + i] = (value >> (8 * i)) & 0xff
+
+    @staticmethod
+    def hex32(value):
+        return value.to_bytes(4, 'little').hex()
+
+    # packets
+
+    def send(self, payload):
+        data = payload.encode('latin-1')
+        self.conn.sendall(b'$' + data + b'#%02x' % (sum(data) & 0xff))
+
+    def receive(self):
+        while True:
+            start = self.buffer.find(b'$')
+            if start >= 0:
+                end = self.buffer.find(b'#', start)
+                if end >= 0 and len(self.buffer) >= end + 3:
+                    payload = self.buffer[start+1:end]
+                    self.buffer = self.buffer[end+3:]
+                    self.conn.sendall(b'+')
+                    return payload.decode('latin-1')
+            elif b'\x03' in self.buffer:
+                self.buffer = b''
+                return '\x03'
+            data = self.conn.recv(4096)
+            if not data:
+                return None
+            self.buffer += data
+
+    def handle(self, packet):
+        sim = self.sim
+        cmd = packet[:1]
+        args = packet[1:]
+        if cmd == '?':
+            return self.stop_reply(self.sigtrap)
+        if cmd == 'g':
+            return ''.join(self.hex32(self.read_register(n)) for n in range(self.reg_count))
+        if cmd == 'G':
+            for n in range(self.reg_count):
+                self.write_register(n, int.from_bytes(bytes.fromhex(args[8*n:8*n+8]), 'little'))
+            return 'OK'
+        if cmd == 'p':
+            n = int(args, 16)
+            if n >= self.reg_count:
+                return 'E01'
+            return self.hex32(self.read_register(n))
+        if cmd == 'P':
+            n, value = args.split('=')
+            n = int(n, 16)
+            if n >= self.reg_count:
+                return 'E01'
+            self.write_register(n, int.from_bytes(bytes.fromhex(value), 'little'))
+            return 'OK'
+        if cmd == 'm':
+            addr, length = (int(v, 16) for v in args.split(','))
+            try:
+                return self.read_memory(addr, length).hex()
+            except IndexError:
+                return 'E01'
+        if cmd == 'M':
+            spec, data = args.split(':')
+            addr, length = (int(v, 16) for v in spec.split(','))
+            try:
+                self.write_memory(addr, bytes.fromhex(data))
+            except IndexError:
+                return 'E01'
+            return 'OK'
+        if cmd in ('Z', 'z') and args[:1] in ('0', '1'):
+            addr = int(args.split(',')[1], 16)
+            sim.set_riscv_breakpoint(addr, cmd == 'Z')
+            return 'OK'
+        if cmd == 'c':
+            if args:
+                self.write_register(32, int(args, 16))
+            return self.stop_reply(self.cont())
+        if cmd == 's':
+            if args:
+                self.write_register(32, int(args, 16))
+            return self.stop_reply(self.sigtrap if self.step() else None)
+        if cmd == 'H':
+            return 'OK'
+        if packet.startswith('qSupported'):
+            return 'PacketSize=4000;qXfer:features:read+'
+        if packet.startswith('qXfer:features:read:target.xml:'):
+            offset, length = (int(v, 16) for v in packet.split(':')[4].split(','))
+            chunk = self.target_xml[offset:offset+length]
+            return ('l' if offset + length >= len(self.target_xml) else 'm') + chunk
+        if packet == 'qAttached':
+            return '1'
+        if packet == 'qC':
+            return 'QC1'
+        return ''
+
+    # Serves one GDB connection.  Returns True if GDB detached, leaving
+    # the simulation to carry on, or False if it killed the simulation
+    # or closed the connection.
+    def serve(self):
+        self.run_to_loop3()
+        self.conn, addr = self.listener.accept()
+        try:
+            while True:
+                packet = self.receive()
+                if packet is None:
+                    return False
+                if packet == '\x03':
+                    self.send(self.stop_reply(self.sigint))
+                    continue
+                if packet == 'k':
+                    return False
+                if packet == 'D':
+                    self.send('OK')
+                    return True
+                reply = self.handle(packet)
+                self.send(reply)
+                if reply.startswith('W'):
+                    return False
+        finally:
+            self.conn.close()
+            self.listener.close()
@@ -14,7 +14,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
 from enum import Enum
+import hashlib
+import os
+import sys
 
 
 IndirectReg = { 'x':   0,
@@ -54,10 +58,17 @@ def bit_count(v):
     return bin(v).count('1')
 
 
+# A field's mask is a list of bytes, most significant first, and the
+# field's bits are packed from its least significant mask bit upward.
+# Extraction and insertion use a list of (position, mask) pairs, one for
+# each contiguous run of mask bits, where position is the shift of the
+# run within the instruction and mask is the run's mask within the field
+# value, so each takes a few integer operations per run.
 class BitField:
     def __init__(self, byte_count = 0):
         self.width = 0  # width of the field within the instruction
         self.mask = bytearray(byte_count)
+        self.__runs = None
 
     def __repr__(self):
         return 'BitField(width = %d, mask = %s' % (self.width, str(self.mask))
@@ -65,21 +76,49 @@ class BitField:
     def append(self, mask_byte):
         self.mask.append(mask_byte)
         self.width += bit_count(mask_byte)
+        self.__runs = None
 
     def pad_length(self, length):
         if len(self.mask) < length:
             self.mask += bytearray(length - len(self.mask))
+            self.__runs = None
+
+    def runs(self):
+        if self.__runs is None:
+            mask = int.from_bytes(self.mask, 'big')
+            runs = []
+            pos = 0
+            vpos = 0
+            while mask:
+                while not mask & 1:
+                    mask >>= 1
+                    pos += 1
+                run_width = 0
+                while mask & 1:
+                    mask >>= 1
+                    run_width += 1
+                runs.append((pos - vpos, ((1 << run_width) - 1) << vpos))
+                pos += run_width
+                vpos += run_width
+            self.__runs = runs
+        return self.__runs
+
+    # word is the instruction as a big-endian integer
+    def extract(self, word):
+        value = 0
+        for shift, mask in self.runs():
+            value |= (word >> shift) & mask
+        return value
 
     def insert(self, bits, value):
         assert isinstance(value, int)
+        assert value >> self.width == 0  # XXX causes negative 8-bit immediates to fail
+        word = 0
+        for shift, mask in self.runs():
+            word |= (value & mask) << shift
         for i in reversed(range(len(bits))):
-            for b in [1 << j for j in range(8)]:
-                if self.mask[i] & b:
-                    if value & 1:
-                        bits[i] |= b
-                    value >>= 1
-        assert value == 0  # XXX causes negative 8-bit immediates to fail
-        
+            bits[i] |= word & 0xff
+            word >>= 8
 
 # An instruction form is a variant of an instruction that takes
 # specific operand types.
@@ -252,20 +291,97 @@ class Glacial:
     ]
 
 
+    # The opcode table has an entry for each of the 65536 opcodes, giving
+    # the index of its form in __forms plus one, or zero if the opcode is
+    # not a valid instruction.  It is built by enumerating the values of
+    # the field bits of each form, and may be cached in a file, keyed by
+    # a hash of the instruction set definition.  By default the cache is
+    # kept next to this file, and shared by all of the tools.
+    __forms = [(inst, form) for inst in __inst_set for form in inst.forms]
+
+    __cache_magic = b'GLACIAL-OPCODES\n'
+
+    default_opcode_table_cache = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'glacial_opcodes.cache')
+
+    @staticmethod
+    def __inst_set_hash():
+        h = hashlib.sha256()
+        for inst, form in Glacial.__forms:
+            h.update(repr((inst.mnem, form.operands, form.encoding)).encode('utf-8'))
+        return h.digest()
+
+    @staticmethod
+    def __opcode_table_build():
+        table = array.array('H', bytes(2 * 0x10000))
+        for index, (inst, form) in enumerate(Glacial.__forms):
+            opcode = form.bits[0] << 8 | form.bits[1]
+            free = ~(form.mask[0] << 8 | form.mask[1]) & 0xffff
+            v = free
+            while True:
+                assert table[opcode | v] == 0
+                table[opcode | v] = index + 1
+                if v == 0:
+                    break
+                v = (v - 1) & free
+        return table
+
+    @staticmethod
+    def __opcode_table_read(f, key):
+        if f.read(len(Glacial.__cache_magic)) != Glacial.__cache_magic:
+            return None
+        if f.read(len(key)) != key:
+            return None
+        table = array.array('H')
+        try:
+            table.fromfile(f, 0x10000)
+        except EOFError:
+            return None
+        if sys.byteorder != 'little':
+            table.byteswap()
+        return table
+
+    @staticmethod
+    def __opcode_table_write(f, key, table):
+        f.write(Glacial.__cache_magic)
+        f.write(key)
+        if sys.byteorder != 'little':
+            table = array.array('H', table)
+            table.byteswap()
+        table.tofile(f)
+
+    # A missing, stale or unreadable cache file is silently rebuilt.  The
+    # new one is written to a temporary file and renamed, so that tools
+    # started at the same time never read a partly written cache.
+    def __opcode_table_init(self, cache_fn):
+        table = None
+        if cache_fn is not None:
+            key = Glacial.__inst_set_hash()
+            try:
+                with open(cache_fn, 'rb') as f:
+                    table = Glacial.__opcode_table_read(f, key)
+            except OSError:
+                pass
+        if table is None:
+            table = Glacial.__opcode_table_build()
+            if cache_fn is not None:
+                temp_fn = '%s.%d' % (cache_fn, os.getpid())
+                try:
+                    with open(temp_fn, 'wb') as f:
+                        Glacial.__opcode_table_write(f, key, table)
+                    os.replace(temp_fn, cache_fn)
+                except OSError:
+                    try:
+                        os.unlink(temp_fn)
+                    except OSError:
+                        pass
+        self.__inst_by_opcode = [None] + Glacial.__forms
+        self.__opcode_table = table
+
     def __mnemonic_table_init(self):
         self.__inst_by_mnemonic = { }
-        self.__inst_by_opcode = { }
         for inst in self.__inst_set:
             if inst.mnem not in self.__inst_by_mnemonic:
                 self.__inst_by_mnemonic[inst.mnem] = inst
-            for form in inst.forms:
-                opcode = form.bits[0] << 8 | form.bits[1]
-                mask = form.mask[0] << 8 | form.mask[1]
-                # XXX inefficient way to populate the table, should enumerate based on fields
-                for i in range(0x10000):
-                    if i & mask == opcode:
-                        assert not i in self.__inst_by_opcode
-                        self.__inst_by_opcode[i] = ( inst, form )
 
     def _mnemonic_table_print(self):
         for mnemonic in sorted(self.__inst_by_mnemonic.keys()):
@@ -276,13 +392,7 @@ class Glacial:
 
     @staticmethod
     def __extract_field(opcode, fields, f):
-        mask = (fields[f].mask[0] << 8) | fields[f].mask[1]
-        width = 0
-        v = 0
-        for i in reversed(range(16)):
-            if mask & (1 << i):
-                v = (v << 1) | ((opcode >> i) & 1)
-                width += 1
+        v = fields[f].extract(opcode)
         if f == 'j':
             v *= 2
         return v
@@ -299,9 +409,9 @@ class Glacial:
 
 
     def opcode_search(self, opcode):
-        if opcode not in self.__inst_by_opcode:
+        if not 0 <= opcode <= 0xffff or not self.__opcode_table[opcode]:
             raise Glacial.BadInstruction()
-        inst, form = self.__inst_by_opcode[opcode]
+        inst, form = self.__inst_by_opcode[self.__opcode_table[opcode]]
         fields = { }
         for f in form.fields:
             fields[f] = self.__extract_field(opcode, form.fields, f)
@@ -403,8 +513,10 @@ class Glacial:
             fields.update(self.__assemble_operand(operands[i], form.operands[i]))
         return form.insert_fields(fields)
 
-    def __init__(self):
+    # opcode_table_cache is None to always build the opcode table.
+    def __init__(self, opcode_table_cache = default_opcode_table_cache):
         self.__mnemonic_table_init()
+        self.__opcode_table_init(opcode_table_cache)
 
 if __name__ == '__main__':
     glacial = Glacial()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# Glacial assembler listing reader
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# asg ends a listing with a blank line followed by the symbol table, one
+# symbol per line as a hex value and a name.  The labels are the symbols
+# that are defined with a colon in the source, as opposed to equates.
+
+import bisect
+import re
+
+
+class Listing:
+
+    symbol_re = re.compile(r'^([0-9a-f]+) (\S+)\s*$')
+    label_re = re.compile(r'([A-Za-z_][A-Za-z_0-9]*):')
+    inst_re = re.compile(r'^\s*\d+\s+([0-9a-f]{4})  ([0-9a-f]{2}) ([0-9a-f]{2})(\s.*)?$')
+    data_directives = { 'db', 'dw', 'ds' }
+
+    def __init__(self, f):
+        self.lines = [line.rstrip('\n') for line in f]
+        self.symbols = { }
+        self.labels = { }
+
+        i = len(self.lines)
+        while i > 0 and self.lines[i-1].strip():
+            i -= 1
+        for line in self.lines[i:]:
+            m = self.symbol_re.match(line)
+            if m:
+                self.symbols[m.group(2)] = int(m.group(1), 16)
+        self.symtab_start = i
+
+        # Where several labels share an address, the last one in the
+        # source is used for addresses at and after it.
+        label_by_addr = { }
+        for line in self.lines[:i]:
+            source = line.split(';', 1)[0]
+            for name in self.label_re.findall(source):
+                if name in self.symbols:
+                    self.labels[name] = self.symbols[name]
+                    label_by_addr[self.symbols[name]] = name
+
+        self.label_addrs = sorted(label_by_addr)
+        self.label_names = [label_by_addr[addr] for addr in self.label_addrs]
+
+    # Returns a list of (line index, address, instruction word) for the
+    # lines that assemble a microinstruction, as opposed to data.
+    def instructions(self):
+        result = [ ]
+        for i, line in enumerate(self.lines[:self.symtab_start]):
+            m = self.inst_re.match(line)
+            if not m:
+                continue
+            source = self.label_re.sub('', (m.group(4) or '').split(';', 1)[0]).split()
+            if source and source[0].lower() not in self.data_directives:
+                result.append((i, int(m.group(1), 16), int(m.group(2) + m.group(3), 16)))
+        return result
+
+    # Returns (label, offset) for the nearest label at or below addr,
+    # or (None, addr) if there is none.
+    def label_at(self, addr):
+        i = bisect.bisect_right(self.label_addrs, addr)
+        if i == 0:
+            return None, addr
+        return self.label_names[i-1], addr - self.label_addrs[i-1]
+
+    def format_addr(self, addr):
+        label, offset = self.label_at(addr)
+        if label is None:
+            return '%04x' % addr
+        if offset == 0:
+            return label
+        return '%s+%d' % (label, offset)
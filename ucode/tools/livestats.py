@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# Live statistics for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Reports simulator throughput periodically, from an interval timer,
+# and on SIGUSR1.  The signal handler only posts the report to the
+# simulator's event queue, so that it is written from the simulator
+# loop between microinstructions, rather than in the middle of another
+# write to stderr, and the loop checks for it along with the other
+# events at no extra cost.  Reports are held back while the simulator
+# isn't running, or is fast-forwarding.  Each report gives the rates
+# since the previous report, and the totals.
+
+import json
+import signal
+import sys
+import time
+
+
+class LiveStats:
+
+    def __init__(self, sim, clock_freq_hz, interval = None, json_file = None, text_file = sys.stderr):
+        self.sim = sim
+        self.clock_freq_hz = clock_freq_hz
+        self.interval = interval
+        self.json_file = json_file
+        self.text_file = text_file
+        self.start_time = time.monotonic()
+        self.prev = (self.start_time, sim.cycle, sim.riscv_insts, sim.uart_bytes)
+
+    def start(self):
+        signal.signal(signal.SIGUSR1, self.handler)
+        if self.interval:
+            signal.signal(signal.SIGALRM, self.handler)
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self):
+        if self.interval:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+    def handler(self, signum, frame):
+        self.sim.events.post(lambda cycle: self.report())
+
+    def sample(self):
+        sim = self.sim
+        now = time.monotonic()
+        prev_time, prev_cycle, prev_riscv_insts, prev_uart_bytes = self.prev
+        self.prev = (now, sim.cycle, sim.riscv_insts, sim.uart_bytes)
+        wall = max(now - prev_time, 1e-9)
+        return { 'wall_time':                  now - self.start_time,
+                 'cycles':                     sim.cycle,
+                 'riscv_instructions':         sim.riscv_insts,
+                 'uart_bytes':                 sim.uart_bytes,
+                 'microinstructions_per_sec':  (sim.cycle - prev_cycle) / 4 / wall,
+                 'riscv_instructions_per_sec': (sim.riscv_insts - prev_riscv_insts) / wall,
+                 'simulated_to_wall':          (sim.cycle - prev_cycle) / self.clock_freq_hz / wall,
+                 'uart_bytes_per_sec':         (sim.uart_bytes - prev_uart_bytes) / wall }
+
+    def report(self):
+        s = self.sample()
+        if self.text_file is not None:
+            print('%.1fs: %d cycles, %.0f uinst/s, %.0f RISC-V inst/s, %.6f simulated/wall, %d UART bytes' %
+                  (s['wall_time'], s['cycles'], s['microinstructions_per_sec'], s['riscv_instructions_per_sec'],
+                   s['simulated_to_wall'], s['uart_bytes']), file = self.text_file)
+            self.text_file.flush()
+        if self.json_file is not None:
+            print(json.dumps(s), file = self.json_file)
+            self.json_file.flush()
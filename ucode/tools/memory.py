@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import math
+import sys
 
 class Memory:
 
@@ -137,6 +138,34 @@ class Memory:
         return mem
 
 
+# For simulation, reads and writes the bytearray of a Memory directly,
+# taking a copy of its valid bitmap.  A read of a byte that has not been
+# loaded or written is passed to report() once per address, rather than
+# raising Memory.Uninitialized, and the read proceeds.  Only integer
+# addresses are supported.
+class UninitializedReadDetector:
+
+    def __init__(self, memory):
+        self.data = memory.data
+        self.valid = bytearray(memory.valid)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, address):
+        if not self.valid[address]:
+            self.valid[address] = 1  # only report once
+            self.report(address)
+        return self.data[address]
+
+    def __setitem__(self, address, data):
+        self.data[address] = data
+        self.valid[address] = 1
+
+    def report(self, address):
+        print('uninitialized read at %04x' % address, file = sys.stderr)
+
+
 if __name__ == '__main__':
     memory = Memory()
 
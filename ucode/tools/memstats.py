@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# Memory access statistics for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Counts memory reads and writes per address, split by access path:
+# microinstruction fetch, direct (8-bit absolute), and indirect through
+# X or Y, with or without postincrement.  The address of each access is
+# known from the decoded microinstruction and the registers before it
+# executes, so the counting is done around the interpreter rather than
+# in each handler.  The interpreter step is sim.execute_single, or
+# another step wrapping it, such as the profiler's, set in step.
+
+import array
+import json
+
+from glacial import OT
+
+
+class MemoryStats:
+
+    paths = ['fetch', 'mem', '@x', '@x+', '@y', '@y+']
+    fetch = 0
+
+    # operand class, x field -> path index
+    path_by_form = { (OT.mem, 0):      1,
+                     (OT.mem, 1):      1,
+                     (OT.ind, 0):      2,
+                     (OT.postinc, 0):  3,
+                     (OT.ind, 1):      4,
+                     (OT.postinc, 1):  5 }
+
+    read_mnemonics = { 'load', 'and', 'xor', 'adc', 'skb' }
+
+    def __init__(self, sim):
+        self.sim = sim
+        size = len(sim.memory)
+        self.reads = [array.array('Q', bytes(8 * size)) for path in self.paths]
+        self.writes = [array.array('Q', bytes(8 * size)) for path in self.paths]
+        self.access_by_ir = { }  # ir -> (path index, write) or None
+        self.step = sim.execute_single
+
+    def access(self, entry):
+        ir, mnem, handler, operand_classes, fields, arg = entry
+        if ir in self.access_by_ir:
+            return self.access_by_ir[ir]
+        a = None
+        if mnem == 'store' or mnem in self.read_mnemonics:
+            path = self.path_by_form.get((operand_classes[0], fields.get('x', 0)))
+            if path is not None:
+                a = (path, mnem == 'store')
+        self.access_by_ir[ir] = a
+        return a
+
+    # Executes one microinstruction with the interpreter and counts its
+    # accesses.  A countdown loop is counted as all of its iterations,
+    # none of which access memory other than by fetch.
+    def execute_single(self):
+        sim = self.sim
+        pc = sim.pc
+        entry = None
+        if pc < sim.ucode_region_size:
+            entry = sim.decode_cache[pc]
+        if entry is None:
+            entry = sim.decode(pc)
+        a = self.access(entry)
+        if a is not None:
+            path, write = a
+            if path == 1:
+                addr = entry[4]['m']
+            elif path < 4:
+                addr = sim.x
+            else:
+                addr = sim.y
+        cycle = sim.cycle
+        self.step()
+        cycles = sim.cycle - cycle
+        if not cycles:
+            return  # halt detected
+        fetch = self.reads[self.fetch]
+        if cycles > 4:
+            n = cycles // 12
+            for addr in (pc, pc + 2, pc + 4):
+                fetch[addr] += n
+                fetch[addr + 1] += n
+            return
+        fetch[pc] += 1
+        fetch[pc + 1] += 1
+        if a is not None:
+            if write:
+                self.writes[path][addr] += 1
+            else:
+                self.reads[path][addr] += 1
+
+    # Returns a list of (name, first address, last address) for the
+    # page zero scratchpad, the rest of the microcode region, and RISC-V
+    # memory.
+    def regions(self):
+        riscv_mem_offset = self.sim.get_u16(0x0002)
+        return [('page zero', 0x0000, 0x00ff),
+                ('microcode', 0x0100, riscv_mem_offset - 1),
+                ('riscv',     riscv_mem_offset, len(self.sim.memory) - 1)]
+
+    # Returns a dict of region name -> path -> [reads, writes].
+    def region_totals(self):
+        totals = { }
+        for name, first, last in self.regions():
+            totals[name] = { }
+            for i, path in enumerate(self.paths):
+                totals[name][path] = [sum(self.reads[i][first:last+1]),
+                                      sum(self.writes[i][first:last+1])]
+        return totals
+
+    def report(self, f):
+        totals = self.region_totals()
+        grand_total = max(sum(r + w for region in totals.values() for r, w in region.values()), 1)
+        print('%-10s %-6s %12s %12s %6s' % ('region', 'path', 'reads', 'writes', '%'), file = f)
+        for name, region in totals.items():
+            for path, (r, w) in region.items():
+                if r or w:
+                    print('%-10s %-6s %12d %12d %6.2f' % (name, path, r, w, 100.0 * (r + w) / grand_total), file = f)
+
+    # The JSON output includes the region totals, and for each address
+    # accessed, the nonzero counts by path.
+    def write_json(self, f):
+        addresses = [ ]
+        for addr in range(len(self.sim.memory)):
+            a = None
+            for i, path in enumerate(self.paths):
+                r = self.reads[i][addr]
+                w = self.writes[i][addr]
+                if r or w:
+                    if a is None:
+                        a = { 'address': addr }
+                    a[path] = [r, w]
+            if a is not None:
+                addresses.append(a)
+        json.dump({ 'paths':      self.paths,
+                    'regions':    [{ 'name': name, 'first': first, 'last': last } for name, first, last in self.regions()],
+                    'totals':     self.region_totals(),
+                    'addresses':  addresses },
+                  f, indent = 1)
+        print(file = f)
@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+# Microcode profiler for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Counts executions and cycles per microcode address.  Cycles spent
+# while a call is outstanding are also charged to the call instruction,
+# using the single-level return address: a call starts the attribution,
+# and a ret ends it.  A call made from within a called subroutine
+# replaces the outstanding call, as it does in the hardware.
+#
+# With block translation, each translated block increments its own
+# counter and charges its cycles to the outstanding call; the counts
+# are spread over the addresses of the block when reporting.  The
+# interpreter path counts each microinstruction as it is executed.
+
+import array
+import json
+
+
+class Profiler:
+
+    def __init__(self, sim):
+        self.sim = sim
+        size = sim.ucode_region_size
+        self.no_call = size  # call_site when no call is outstanding
+        self.counts = array.array('Q', bytes(8 * size))
+        self.cycles = array.array('Q', bytes(8 * size))
+        self.call_cycles = array.array('Q', bytes(8 * (size + 1)))
+        self.call_site = self.no_call
+        self.blocks = [ ]  # (start, length) of translated blocks
+        self.block_counts = array.array('Q')
+
+    # Returns the index of a new counter for a translated block of
+    # length microinstructions starting at start.
+    def add_block(self, start, length):
+        self.blocks.append((start, length))
+        self.block_counts.append(0)
+        return len(self.blocks) - 1
+
+    # Executes one microinstruction with the interpreter and counts it.
+    # A countdown loop is counted as all of its iterations.
+    def execute_single(self):
+        sim = self.sim
+        pc = sim.pc
+        cycle = sim.cycle
+        sim.execute_single()
+        cycles = sim.cycle - cycle
+        if not cycles:
+            return  # halt detected
+        self.count(pc, cycles)
+
+    def count(self, pc, cycles):
+        if cycles > 4:
+            n = cycles // 12
+            for addr in (pc, pc + 2, pc + 4):
+                self.counts[addr] += n
+                self.cycles[addr] += 4 * n
+        else:
+            self.counts[pc] += 1
+            self.cycles[pc] += cycles
+        self.call_cycles[self.call_site] += cycles
+        entry = self.sim.decode_cache[pc]
+        if entry is None:
+            entry = self.sim.decode(pc)
+        if entry[1] == 'call':
+            self.call_site = pc
+        elif entry[1] == 'opr' and entry[4]['i'] & 0x040:  # ret
+            self.call_site = self.no_call
+
+    # Returns the per-address counts and cycles, including those of
+    # translated blocks.
+    def totals(self):
+        counts = array.array('Q', self.counts)
+        cycles = array.array('Q', self.cycles)
+        for (start, length), n in zip(self.blocks, self.block_counts):
+            for addr in range(start, start + 2 * length, 2):
+                counts[addr] += n
+                cycles[addr] += 4 * n
+        return counts, cycles
+
+    # Returns a list of dicts, one per label (or address, without a
+    # listing), sorted by decreasing cycles.
+    def by_label(self, listing = None):
+        counts, cycles = self.totals()
+        labels = { }
+        for addr in range(len(counts)):
+            if not counts[addr] and not self.call_cycles[addr]:
+                continue
+            if listing is None:
+                name, offset = None, 0
+            else:
+                name, offset = listing.label_at(addr)
+            if name is None:
+                name = '%04x' % addr
+                start = addr
+            else:
+                start = addr - offset
+            if name not in labels:
+                labels[name] = { 'label':             name,
+                                 'address':           start,
+                                 'executions':        0,
+                                 'instructions':      0,
+                                 'cycles':            0,
+                                 'called_cycles':     0 }
+            l = labels[name]
+            if offset == 0:
+                l['executions'] += counts[addr]
+            l['instructions'] += counts[addr]
+            l['cycles'] += cycles[addr]
+            l['called_cycles'] += self.call_cycles[addr]
+        result = sorted(labels.values(), key = lambda l: (-l['cycles'], l['address']))
+        for l in result:
+            l['inclusive_cycles'] = l['cycles'] + l['called_cycles']
+        return result
+
+    def report(self, f, listing = None):
+        labels = self.by_label(listing)
+        total = max(sum(l['cycles'] for l in labels), 1)
+        print('%12s %6s %12s %6s %12s  %s' % ('cycles', '%', 'inclusive', '%', 'instructions', 'label'), file = f)
+        for l in labels:
+            print('%12d %6.2f %12d %6.2f %12d  %s' % (l['cycles'],
+                                                    100.0 * l['cycles'] / total,
+                                                    l['inclusive_cycles'],
+                                                    100.0 * l['inclusive_cycles'] / total,
+                                                    l['instructions'],
+                                                    l['label']), file = f)
+
+    def write_json(self, f, listing = None):
+        counts, cycles = self.totals()
+        addresses = [ ]
+        for addr in range(len(counts)):
+            if counts[addr] or self.call_cycles[addr]:
+                a = { 'address':     addr,
+                      'executions':  counts[addr],
+                      'cycles':      cycles[addr] }
+                if self.call_cycles[addr]:
+                    a['called_cycles'] = self.call_cycles[addr]
+                if listing is not None:
+                    a['label'] = listing.format_addr(addr)
+                addresses.append(a)
+        json.dump({ 'total_cycles': sum(cycles),
+                    'labels':       self.by_label(listing),
+                    'addresses':    addresses },
+                  f, indent = 1)
+        print(file = f)
+
+
+# Attributes microcode cycles to RISC-V instructions.  boundary() is
+# called each time the microcode reaches the RISC-V instruction boundary
+# (once per instruction executed, after the next pc has been chosen);
+# the cycles since the previous boundary are charged to the instruction
+# whose pc was current then, and whose instruction register is current
+# now.  This includes any trap taken by the instruction, and the
+# main_loop timer and interrupt checks before the next instruction.
+class RiscvProfiler:
+
+    opcode_class = { 0x00: 'load',
+                     0x02: 'custom-0',
+                     0x03: 'misc-mem',
+                     0x04: 'op-imm',
+                     0x05: 'auipc',
+                     0x08: 'store',
+                     0x0c: 'op',
+                     0x0d: 'lui',
+                     0x18: 'branch',
+                     0x19: 'jalr',
+                     0x1b: 'jal',
+                     0x1c: 'system' }
+
+    funct3_mnemonic = { 0x00: ['lb', 'lh', 'lw', None, 'lbu', 'lhu', None, None],
+                        0x03: ['fence', 'fence.i', None, None, None, None, None, None],
+                        0x04: ['addi', 'slli', 'slti', 'sltiu', 'xori', 'srli', 'ori', 'andi'],
+                        0x08: ['sb', 'sh', 'sw', None, None, None, None, None],
+                        0x0c: ['add', 'sll', 'slt', 'sltu', 'xor', 'srl', 'or', 'and'],
+                        0x18: ['beq', 'bne', None, None, 'blt', 'bge', 'bltu', 'bgeu'],
+                        0x1c: [None, 'csrrw', 'csrrs', 'csrrc', None, 'csrrwi', 'csrrsi', 'csrrci'] }
+
+    system_mnemonic = { 0x00000073: 'ecall',
+                        0x00100073: 'ebreak',
+                        0x30200073: 'mret',
+                        0x10500073: 'wfi' }
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.prev_pc = None
+        self.prev_cycle = None
+        self.by_pc = { }  # pc -> [count, cycles, ir]
+
+    def boundary(self):
+        sim = self.sim
+        pc = sim.get_u32(0xc8)
+        if self.prev_pc is not None:
+            ir = sim.get_u32(0xcc)
+            cycles = sim.cycle - self.prev_cycle
+            entry = self.by_pc.get(self.prev_pc)
+            if entry is None:
+                self.by_pc[self.prev_pc] = [1, cycles, ir]
+            else:
+                entry[0] += 1
+                entry[1] += cycles
+                entry[2] = ir
+        self.prev_pc = pc
+        self.prev_cycle = sim.cycle
+
+    @staticmethod
+    def classify(ir):
+        if ir & 0x03 != 0x03:
+            return 'illegal', 'illegal'
+        opcode = (ir >> 2) & 0x1f
+        cls = RiscvProfiler.opcode_class.get(opcode)
+        if cls is None:
+            return 'illegal', 'illegal'
+        mnemonic = None
+        if opcode == 0x1c and (ir >> 12) & 0x07 == 0:
+            mnemonic = RiscvProfiler.system_mnemonic.get(ir)
+        elif opcode in RiscvProfiler.funct3_mnemonic:
+            funct3 = (ir >> 12) & 0x07
+            mnemonic = RiscvProfiler.funct3_mnemonic[opcode][funct3]
+            if ir & 0x40000000 and (opcode, funct3) in [(0x04, 5), (0x0c, 0), (0x0c, 5)]:
+                mnemonic = { 'srli': 'srai', 'add': 'sub', 'srl': 'sra' }[mnemonic]
+        elif opcode != 0x1c:
+            mnemonic = cls
+        if mnemonic is None:
+            mnemonic = cls + '?'
+        return cls, mnemonic
+
+    # Returns lists of dicts for opcode classes, mnemonics and pcs,
+    # each sorted by decreasing cycles.
+    def summaries(self):
+        by_class = { }
+        by_mnemonic = { }
+        by_pc = [ ]
+        for pc, (count, cycles, ir) in self.by_pc.items():
+            cls, mnemonic = self.classify(ir)
+            for d, key in [(by_class, cls), (by_mnemonic, mnemonic)]:
+                if key not in d:
+                    d[key] = { 'name': key, 'count': 0, 'cycles': 0 }
+                d[key]['count'] += count
+                d[key]['cycles'] += cycles
+            by_pc.append({ 'pc':       pc,
+                           'ir':       ir,
+                           'name':     mnemonic,
+                           'count':    count,
+                           'cycles':   cycles })
+        result = [ ]
+        for l in [list(by_class.values()), list(by_mnemonic.values()), by_pc]:
+            for d in l:
+                d['average'] = d['cycles'] / d['count']
+            result.append(sorted(l, key = lambda d: -d['cycles']))
+        return result
+
+    # elf_files is a list of ElfFile used to label pcs as symbol+offset.
+    @staticmethod
+    def symbolize(pc, elf_files):
+        for elf_file in elf_files:
+            sym, offset = elf_file.lookup(pc)
+            if sym is not None:
+                return elf_file.format_addr(pc)
+        return None
+
+    def report(self, f, max_pcs = 40, elf_files = []):
+        by_class, by_mnemonic, by_pc = self.summaries()
+        total = max(sum(d['cycles'] for d in by_class), 1)
+        for title, l in [('class', by_class), ('instruction', by_mnemonic)]:
+            print('%12s %6s %10s %8s  %s' % ('cycles', '%', 'count', 'average', title), file = f)
+            for d in l:
+                print('%12d %6.2f %10d %8.1f  %s' % (d['cycles'], 100.0 * d['cycles'] / total, d['count'], d['average'], d['name']), file = f)
+            print(file = f)
+        print('%12s %6s %10s %8s  %-8s %-8s %-11s %s' % ('cycles', '%', 'count', 'average', 'pc', 'ir', 'instruction', 'symbol'), file = f)
+        for d in by_pc[:max_pcs]:
+            print('%12d %6.2f %10d %8.1f  %08x %08x %-11s %s' % (d['cycles'], 100.0 * d['cycles'] / total, d['count'], d['average'], d['pc'], d['ir'], d['name'],
+                                                             self.symbolize(d['pc'], elf_files) or ''), file = f)
+
+    def write_json(self, f, elf_files = []):
+        by_class, by_mnemonic, by_pc = self.summaries()
+        for d in by_pc:
+            symbol = self.symbolize(d['pc'], elf_files)
+            if symbol is not None:
+                d['symbol'] = symbol
+        json.dump({ 'total_cycles':  sum(d['cycles'] for d in by_class),
+                    'classes':       by_class,
+                    'instructions':  by_mnemonic,
+                    'pcs':           sorted(by_pc, key = lambda d: d['pc']) },
+                  f, indent = 1)
+        print(file = f)
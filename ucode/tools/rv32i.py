@@ -0,0 +1,428 @@
+#!/usr/bin/python3
+# Native RV32I interpreter for fast-forwarding the Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The interpreter works directly on the microcode's memory layout:
+# x1..x31 at 0x04, nextpc, the CSRs, and RISC-V memory starting at
+# riscv_mem_offset.  Each step corresponds to one pass through the
+# microcode main_loop, or through loop3 for the first instruction of a
+# trap handler, and mirrors what the microcode does, including
+# its deviations from the privileged architecture: incrementing mtime
+# once per instruction, its handling of mtimeh and mip.MTIP, the incomplete CSR
+# decode, the truncation of RISC-V addresses to ft_mem_addr_bytes, and
+# the J-type immediate taking bit 11 from IR bit 28.
+#
+# On return, the architectural state in memory (registers, nextpc, CSRs,
+# RISC-V memory including mtime), along with the pc, ir and dest
+# locations, is what the microcode would have left at main_loop (or at
+# loop3).  The other microcode scratch locations (s1, s2, temp, temp2,
+# access_type) are dead there, and are not reproduced.  This only matters for
+# the undocumented CSRs 0x345..0x347 that alias them.
+
+import struct
+
+
+class RV32I:
+
+    class Trap(Exception):
+        def __init__(self, cause):
+            super().__init__('trap cause %x' % cause)
+            self.cause = cause
+
+    u32 = struct.Struct('<I')
+    u64 = struct.Struct('<Q')
+
+    # page zero locations, from ucode.asm
+    nextpc_addr = 0x80
+    mstatus_addr = 0x84
+    mie_addr = 0x94
+    mtvec_addr = 0x98
+    dest_addr = 0xa0
+    mepc_addr = 0xa8
+    mcause_addr = 0xac
+    mtval_addr = 0xb0
+    mip_addr = 0xb4
+    pc_addr = 0xc8
+    ir_addr = 0xcc
+    csr_300_start = 0x84
+
+    # RISC-V addresses of memory-mapped timer registers
+    mtime = 0x10
+    mtimecmp = 0x18
+
+    # exception causes
+    cause_misaligned_fetch = 0
+    cause_fetch_fault = 1
+    cause_illegal = 2
+    cause_breakpoint = 3
+    cause_misaligned_load = 4
+    cause_load_fault = 5
+    cause_misaligned_store = 6
+    cause_store_fault = 7
+    cause_ecall = 11
+
+    interrupt = 0x80000000
+
+    # data is the simulator memory as a bytearray.  Called with the
+    # glacial address of each byte written below ucode_region_size, if
+    # invalidate is not None.  Called with each byte output by the
+    # custom-0 instruction, which the microcode sends to the UART.  If
+    # valid is not None, it is the valid bitmap used for uninitialized
+    # read detection, and each byte written is marked valid in it.
+    def __init__(self, data, riscv_mem_offset, addr_bytes = 2,
+                 ucode_region_size = 0x1000, invalidate = None, output = None,
+                 valid = None):
+        self.data = data
+        self.valid = valid
+        self.riscv_mem_offset = riscv_mem_offset
+        self.addr_mask = (1 << (8 * addr_bytes)) - 1
+        self.ucode_region_size = ucode_region_size
+        self.invalidate = invalidate
+        self.output = output
+        self.run = True
+        self.trapped = False
+
+    def r32(self, addr):
+        return self.u32.unpack_from(self.data, addr)[0]
+
+    def w32(self, addr, value):
+        self.u32.pack_into(self.data, addr, value & 0xffffffff)
+        if self.valid is not None:
+            self.valid[addr:addr+4] = b'\x01\x01\x01\x01'
+
+    # Convert a RISC-V address to a glacial address, as set_mem_addr does.
+    def translate(self, addr, cause):
+        gaddr = (addr & self.addr_mask) + self.riscv_mem_offset
+        if gaddr > self.addr_mask:
+            raise RV32I.Trap(cause)
+        return gaddr
+
+    def store_bytes(self, gaddr, value, count):
+        for i in range(count):
+            self.data[gaddr + i] = (value >> (8 * i)) & 0xff
+            if self.valid is not None:
+                self.valid[gaddr + i] = 1
+            if gaddr + i < self.ucode_region_size and self.invalidate is not None:
+                self.invalidate(gaddr + i)
+
+    @staticmethod
+    def sext(value, bits):
+        sign = 1 << (bits - 1)
+        return ((value & (2 * sign - 1)) ^ sign) - sign
+
+    def load_state(self):
+        self.x = [0] + [self.r32(4 * i) for i in range(1, 32)]
+        self.pc = self.r32(self.pc_addr)
+        self.ir = self.r32(self.ir_addr)
+        self.dest = self.r32(self.dest_addr)
+
+    def store_state(self):
+        for i in range(1, 32):
+            self.w32(4 * i, self.x[i])
+        self.w32(self.pc_addr, self.pc)
+        self.w32(self.ir_addr, self.ir)
+        self.w32(self.dest_addr, self.dest)
+
+    def put_rd(self, value):
+        self.dest = value & 0xffffffff
+        rd = (self.ir >> 7) & 0x1f
+        if rd:
+            self.x[rd] = self.dest
+
+    def take_trap(self, cause):
+        self.w32(self.mcause_addr, cause)
+        mstatus = self.data[self.mstatus_addr]
+        mpie = 0x80 if mstatus & 0x08 else 0x00
+        self.data[self.mstatus_addr] = ((mstatus & 0x7f) | mpie) & 0xf7
+        self.w32(self.mepc_addr, self.pc)
+        self.pc = self.r32(self.mtvec_addr) & 0xfffffffc
+
+    # One pass through main_loop, or, if the previous instruction
+    # trapped, through loop3 to execute the first instruction of the
+    # trap handler, as the microcode does.
+    def step(self):
+        if not self.trapped:
+            try:
+                nextpc = self.r32(self.nextpc_addr)
+                if nextpc & 0x03:
+                    self.w32(self.mtval_addr, nextpc)
+                    raise RV32I.Trap(self.cause_misaligned_fetch)
+                self.pc = nextpc
+
+                # When the low word of mtime carries, the microcode writes
+                # the pc to the high word, but compares the correctly
+                # incremented value to mtimecmp.
+                mtime_addr = self.translate(self.mtime, 0)
+                mtime = (self.u64.unpack_from(self.data, mtime_addr)[0] + 1) & 0xffffffffffffffff
+                self.w32(mtime_addr, mtime)
+                if mtime & 0xffffffff == 0:
+                    self.w32(mtime_addr + 4, nextpc)
+                if mtime < self.u64.unpack_from(self.data, self.translate(self.mtimecmp, 0))[0]:
+                    self.data[self.mip_addr] |= 0x80
+
+                if self.data[self.mstatus_addr] & 0x08:
+                    mip = self.r32(self.mip_addr)
+                    mie = self.r32(self.mie_addr)
+                    if mip & mie & 0x800:
+                        raise RV32I.Trap(self.interrupt | 11)
+                    if mip & mie & 0x008:
+                        raise RV32I.Trap(self.interrupt | 3)
+                    if mip & mie & 0x080:
+                        raise RV32I.Trap(self.interrupt | 7)
+            except RV32I.Trap as t:
+                self.take_trap(t.cause)
+
+        try:
+            self.execute()
+            self.trapped = False
+        except RV32I.Trap as t:
+            self.take_trap(t.cause)
+            self.trapped = True
+
+    def illegal(self):
+        self.w32(self.mtval_addr, self.ir)
+        raise RV32I.Trap(self.cause_illegal)
+
+    def execute(self):
+        pc = self.pc
+        self.w32(self.nextpc_addr, pc + 4)
+        ir = self.r32(self.translate(pc, self.cause_fetch_fault))
+        self.ir = ir
+        if ir & 0x03 != 0x03:
+            self.illegal()
+        self.dispatch[(ir >> 2) & 0x1f](self, ir)
+
+    def inst_illegal(self, ir):
+        self.illegal()
+
+    def inst_custom0(self, ir):
+        if self.output is not None:
+            self.output(self.x[(ir >> 15) & 0x1f] & 0xff)
+
+    def inst_load(self, ir):
+        ea = (self.x[(ir >> 15) & 0x1f] + self.sext(ir >> 20, 12)) & 0xffffffff
+        gaddr = self.translate(ea, self.cause_load_fault)
+        funct3 = (ir >> 12) & 0x07
+        if funct3 in (3, 6, 7):
+            self.illegal()
+        if (funct3 == 2 and ea & 0x03) or (funct3 in (1, 5) and ea & 0x01):
+            self.w32(self.mtval_addr, ea)
+            raise RV32I.Trap(self.cause_misaligned_load)
+        data = self.data
+        if funct3 == 0:
+            value = self.sext(data[gaddr], 8)
+        elif funct3 == 1:
+            value = self.sext(data[gaddr] | (data[gaddr+1] << 8), 16)
+        elif funct3 == 2:
+            value = self.u32.unpack_from(data, gaddr)[0]
+        elif funct3 == 4:
+            value = data[gaddr]
+        else:
+            value = data[gaddr] | (data[gaddr+1] << 8)
+        self.put_rd(value)
+
+    def inst_misc_mem(self, ir):
+        pass  # ignore FENCE, FENCE.I
+
+    def alu(self, ir, s1, s2):
+        funct3 = (ir >> 12) & 0x07
+        if funct3 == 0:
+            return s1 + s2
+        if funct3 == 1:
+            return s1 << (s2 & 0x1f)
+        if funct3 == 2:
+            return int(self.sext(s1, 32) < self.sext(s2, 32))
+        if funct3 == 3:
+            return int(s1 < s2)
+        if funct3 == 4:
+            return s1 ^ s2
+        if funct3 == 5:
+            if ir & 0x40000000:
+                return self.sext(s1, 32) >> (s2 & 0x1f)
+            return s1 >> (s2 & 0x1f)
+        if funct3 == 6:
+            return s1 | s2
+        return s1 & s2
+
+    def inst_op_imm(self, ir):
+        self.put_rd(self.alu(ir,
+                             self.x[(ir >> 15) & 0x1f],
+                             self.sext(ir >> 20, 12) & 0xffffffff))
+
+    def inst_auipc(self, ir):
+        self.put_rd(self.pc + (ir & 0xfffff000))
+
+    def inst_store(self, ir):
+        ea = (self.x[(ir >> 15) & 0x1f] + self.sext(((ir >> 20) & 0xfe0) | ((ir >> 7) & 0x1f), 12)) & 0xffffffff
+        gaddr = self.translate(ea, self.cause_store_fault)
+        if ea & 0xfffffff8 == self.mtimecmp:
+            self.data[self.mip_addr] &= 0x7f
+        funct3 = (ir >> 12) & 0x07
+        if funct3 > 2:
+            self.illegal()
+        if (funct3 == 2 and ea & 0x03) or (funct3 == 1 and ea & 0x01):
+            self.w32(self.mtval_addr, ea)
+            raise RV32I.Trap(self.cause_misaligned_store)
+        self.store_bytes(gaddr, self.x[(ir >> 20) & 0x1f], 1 << funct3)
+
+    def inst_op(self, ir):
+        s1 = self.x[(ir >> 15) & 0x1f]
+        s2 = self.x[(ir >> 20) & 0x1f]
+        if ir & 0x40007000 == 0x40000000:  # sub
+            self.put_rd(s1 - s2)
+        else:
+            self.put_rd(self.alu(ir, s1, s2))
+
+    def inst_lui(self, ir):
+        self.put_rd(ir & 0xfffff000)
+
+    def inst_branch(self, ir):
+        funct3 = (ir >> 12) & 0x07
+        s1 = self.x[(ir >> 15) & 0x1f]
+        s2 = self.x[(ir >> 20) & 0x1f]
+        if funct3 in (2, 3):
+            self.illegal()
+        if funct3 < 2:
+            taken = s1 == s2
+        elif funct3 < 6:
+            taken = self.sext(s1, 32) < self.sext(s2, 32)
+        else:
+            taken = s1 < s2
+        if taken != bool(funct3 & 1):
+            offset = (((ir >> 7) & 0x1e) |
+                      ((ir >> 20) & 0x7e0) |
+                      ((ir << 4) & 0x800) |
+                      ((ir >> 19) & 0x1000))
+            self.w32(self.nextpc_addr, self.pc + self.sext(offset, 13))
+
+    def inst_jalr(self, ir):
+        target = (self.x[(ir >> 15) & 0x1f] + self.sext(ir >> 20, 12)) & 0xfffffffe
+        self.put_rd(self.pc + 4)
+        self.w32(self.nextpc_addr, target)
+
+    def inst_jal(self, ir):
+        offset = (((ir >> 20) & 0x7fe) |
+                  ((ir >> 17) & 0x800) |  # microcode takes imm[11] from IR bit 28
+                  (ir & 0xff000) |
+                  ((ir >> 11) & 0x100000))
+        self.put_rd(self.pc + 4)
+        self.w32(self.nextpc_addr, self.pc + self.sext(offset, 21))
+
+    def inst_system(self, ir):
+        funct3 = (ir >> 12) & 0x07
+        if funct3 & 0x03 == 0:
+            if (ir >> 8) & 0xff or (ir >> 16) & 0xcfcf:
+                self.illegal()
+            op = (ir >> 20) & 0x03
+            if op == 0:
+                raise RV32I.Trap(self.cause_ecall)
+            if op == 1:
+                raise RV32I.Trap(self.cause_breakpoint)
+            if op == 3 or ir >> 24 != 0x30:
+                self.illegal()
+            # mret
+            mstatus = self.data[self.mstatus_addr]
+            self.data[self.mstatus_addr] = (mstatus & 0xf7) | ((mstatus >> 4) & 0x08)
+            self.w32(self.nextpc_addr, self.r32(self.mepc_addr))
+            return
+
+        if funct3 & 0x04:
+            s1 = (ir >> 15) & 0x1f
+        else:
+            s1 = self.x[(ir >> 15) & 0x1f]
+
+        # get_csr
+        if (ir >> 24) & 0xfb != 0x30 or ir & 0x00800000:
+            self.illegal()
+        csr_addr = self.csr_300_start + 4 * ((ir >> 20) & 0x07)
+        if ir & 0x04000000:
+            csr_addr += 0x20
+        old = self.r32(csr_addr)
+
+        # Write dest before the CSR, and read it back for rd, since
+        # dest is also accessible as CSR 0x307.
+        self.w32(self.dest_addr, old)
+        if funct3 & 0x03 == 1:
+            self.w32(csr_addr, s1)
+        elif funct3 & 0x03 == 2:
+            self.w32(csr_addr, old | s1)
+        else:
+            self.w32(csr_addr, old & ~s1)
+        self.put_rd(self.r32(self.dest_addr))
+
+    dispatch = [inst_load,      # -000 00-- load
+                inst_illegal,   # -000 01-- load-fp
+                inst_custom0,   # -000 10-- custom-0
+                inst_misc_mem,  # -000 11-- misc-mem
+                inst_op_imm,    # -001 00-- op-imm
+                inst_auipc,     # -001 01-- auipc
+                inst_illegal,   # -001 10-- op-imm-32
+                inst_illegal,   # -001 11-- 48b
+                inst_store,     # -010 00-- store
+                inst_illegal,   # -010 01-- store-fp
+                inst_illegal,   # -010 10-- custom-1
+                inst_illegal,   # -010 11-- amo
+                inst_op,        # -011 00-- op
+                inst_lui,       # -011 01-- lui
+                inst_illegal,   # -011 10-- op-32
+                inst_illegal,   # -011 11-- 64b
+                inst_illegal,   # -100 00-- madd
+                inst_illegal,   # -100 01-- msub
+                inst_illegal,   # -100 10-- nmsub
+                inst_illegal,   # -100 11-- nmadd
+                inst_illegal,   # -101 00-- op-fp
+                inst_illegal,   # -101 01-- reserved
+                inst_illegal,   # -101 10-- custom-2/rv128
+                inst_illegal,   # -101 11-- 48b
+                inst_branch,    # -110 00-- branch
+                inst_jalr,      # -110 01-- jalr
+                inst_illegal,   # -110 10-- reserved
+                inst_jal,       # -110 11-- jal
+                inst_system,    # -111 00-- system
+                inst_illegal,   # -111 01-- reserved
+                inst_illegal,   # -111 10-- custom-3/rv128
+                inst_illegal]   # -111 11-- >=80b
+
+    # Run until max_insts instructions have been executed (or have
+    # trapped), until the next instruction to execute is at until_pc, or
+    # until self.run is cleared (by the output function, or halt detection
+    # of a jump to itself).  Returns the number of instructions.  If
+    # self.trapped is set on return, the microcode must continue at loop3
+    # rather than main_loop.
+    def simulate(self, max_insts = None, until_pc = None, halt_detection = False):
+        self.load_state()
+        count = 0
+        prev_pc = None
+        try:
+            while self.run:
+                if max_insts is not None and count >= max_insts:
+                    break
+                if self.trapped:
+                    pc = self.pc
+                else:
+                    pc = self.r32(self.nextpc_addr)
+                if pc == until_pc:
+                    break
+                if halt_detection and pc == prev_pc:
+                    ir = self.r32(self.translate(pc, 0))
+                    if ir & 0x77 == 0x67:
+                        self.run = False
+                        break
+                prev_pc = pc
+                self.step()
+                count += 1
+        finally:
+            self.store_state()
+        return count
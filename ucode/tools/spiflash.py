@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# SPI NOR flash model for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A read-only SPI NOR flash, in SPI mode 0, with its contents memory-
+# mapped from an image file, so that large images aren't read in.  Bits
+# are shifted in and out most significant first, but commands are
+# decoded a byte at a time: each byte received determines the byte to
+# be shifted out while the next one is received.  Supported commands
+# are READ, FAST_READ, RDID and RDSR, with WREN and WRDI only changing
+# the write enable latch in the status register.  Addresses beyond the
+# end of the image read as erased.
+
+import mmap
+
+
+class SpiFlash:
+
+    cmd_wrdi =      0x04
+    cmd_rdsr =      0x05
+    cmd_wren =      0x06
+    cmd_read =      0x03
+    cmd_fast_read = 0x0b
+    cmd_rdid =      0x9f
+
+    status_wel = 0x02
+
+    address_bytes = 3
+
+    def __init__(self, f, jedec_id = bytes([0xef, 0x40, 0x18])):
+        f.seek(0, 2)
+        if f.tell():
+            self.image = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self.image = b''
+        self.jedec_id = jedec_id
+        self.status = 0x00
+        self.selected = False
+        self.in_byte = 0
+        self.out_byte = 0xff
+        self.bit_count = 0
+        self.count = 0
+        self.cmd = None
+        self.addr = 0
+
+    def close(self):
+        if isinstance(self.image, mmap.mmap):
+            self.image.close()
+
+    # Selecting the flash (driving CS# low) starts a new command.
+    def set_cs(self, selected):
+        if selected and not self.selected:
+            self.in_byte = 0
+            self.out_byte = 0xff
+            self.bit_count = 0
+            self.count = 0
+            self.cmd = None
+        self.selected = bool(selected)
+
+    # Shifts one bit in from MOSI, and returns the bit shifted out on
+    # MISO, which floats high when the flash isn't selected.
+    def xfer_bit(self, mosi):
+        if not self.selected:
+            return 1
+        miso = self.out_byte >> 7
+        self.out_byte = (self.out_byte << 1) & 0xff
+        self.in_byte = ((self.in_byte << 1) | mosi) & 0xff
+        self.bit_count += 1
+        if self.bit_count == 8:
+            self.bit_count = 0
+            self.out_byte = self.receive_byte(self.in_byte)
+        return miso
+
+    def read_byte(self):
+        addr = self.addr
+        self.addr = (addr + 1) & 0xffffff
+        if addr < len(self.image):
+            return self.image[addr]
+        return 0xff
+
+    # Returns the byte to shift out next.
+    def receive_byte(self, value):
+        n = self.count
+        self.count += 1
+        if n == 0:
+            self.cmd = value
+            if value == self.cmd_wren:
+                self.status |= self.status_wel
+            elif value == self.cmd_wrdi:
+                self.status &= ~self.status_wel
+            elif value == self.cmd_rdid:
+                return self.jedec_id[0]
+            elif value == self.cmd_rdsr:
+                return self.status
+            self.addr = 0
+            return 0xff
+        cmd = self.cmd
+        if cmd == self.cmd_rdid:
+            return self.jedec_id[n] if n < len(self.jedec_id) else 0xff
+        if cmd == self.cmd_rdsr:
+            return self.status
+        if cmd == self.cmd_read or cmd == self.cmd_fast_read:
+            if n <= self.address_bytes:
+                self.addr = (self.addr << 8) | value
+                if n < self.address_bytes or cmd == self.cmd_fast_read:
+                    return 0xff
+            # FAST_READ has a dummy byte after the address.
+            return self.read_byte()
+        return 0xff
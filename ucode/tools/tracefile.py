@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# Binary microinstruction trace files for Glacial simulator
+# Copyright 2018 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A trace file is a header giving the record size and the cycle count
+# of the first record, followed by one fixed-size little-endian record
+# per microinstruction executed:
+#     pc, ir, A, carry, X, value written, Y, address written
+# The registers are those before the microinstruction executes.  The
+# address written is no_write for microinstructions other than store.
+# Each microinstruction takes four cycles, so the cycle count of a
+# record follows from its position.
+
+import struct
+
+from glacial import OT
+
+
+class TraceFile:
+
+    class FormatError(Exception):
+        pass
+
+    magic = b'GLTRACE1'
+    header_struct = struct.Struct('<8sIQ')  # magic, record size, first cycle
+    record_struct = struct.Struct('<HHBBBBII')
+    no_write = 0xffffffff
+
+
+# Packs the record for the microinstruction at pc, from the simulator
+# registers before it executes.  entry is its decode cache entry.
+def pack_record(buffer, offset, sim, pc, entry):
+    waddr = TraceFile.no_write
+    wval = 0
+    if entry[1] == 'store':
+        fields = entry[4]
+        if entry[3][0] == OT.mem:
+            waddr = fields['m']
+        elif fields['x']:
+            waddr = sim.y
+        else:
+            waddr = sim.x
+        wval = sim.accumulator
+    TraceFile.record_struct.pack_into(buffer, offset,
+                                      pc, entry[0],
+                                      sim.accumulator, sim.carry, sim.x,
+                                      wval, sim.y, waddr)
+
+
+# Formats a record as text.  disassembly is a dict caching the decoded
+# instructions by ir, and listing is an optional Listing for labels.
+def format_record(arch, record, disassembly, listing = None):
+    cycle, pc, ir, a, c, x, y, waddr, wval = record
+    d = disassembly.get(ir)
+    if d is None:
+        d = arch.decode_instruction(ir)
+        disassembly[ir] = d
+    mnem, operand_classes, fields = d
+    s = '%10d A=%02x C=%d X=%02x Y=%04x %04x: %04x %s %s %s' % (cycle, a, c, x, y, pc, ir, mnem, operand_classes, fields)
+    if waddr != TraceFile.no_write:
+        s += ' [%04x]=%02x' % (waddr, wval)
+    if listing is not None:
+        s += '  ; ' + listing.format_addr(pc)
+    return s
+
+
+class TraceRecorder:
+
+    def __init__(self, f, first_cycle = 0, buffer_records = 0x10000):
+        self.f = f
+        self.buffer = bytearray(buffer_records * TraceFile.record_struct.size)
+        self.offset = 0
+        f.write(TraceFile.header_struct.pack(TraceFile.magic,
+                                             TraceFile.record_struct.size,
+                                             first_cycle))
+
+    # entry is the decode cache entry of the microinstruction at pc.
+    def record(self, sim, pc, entry):
+        pack_record(self.buffer, self.offset, sim, pc, entry)
+        self.offset += TraceFile.record_struct.size
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    # Called at each RISC-V instruction boundary; nothing is recorded.
+    def boundary(self, sim):
+        pass
+
+    def flush(self):
+        self.f.write(memoryview(self.buffer)[:self.offset])
+        self.offset = 0
+        self.f.flush()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+# Iterates over (cycle, pc, ir, a, c, x, y, write address, write value)
+# tuples, reading the file in large blocks.
+class TraceReader:
+
+    def __init__(self, f, block_records = 0x10000):
+        header = f.read(TraceFile.header_struct.size)
+        if len(header) != TraceFile.header_struct.size:
+            raise TraceFile.FormatError('truncated header')
+        magic, record_size, self.first_cycle = TraceFile.header_struct.unpack(header)
+        if magic != TraceFile.magic or record_size != TraceFile.record_struct.size:
+            raise TraceFile.FormatError('not a trace file')
+        self.f = f
+        self.block_size = block_records * record_size
+
+    def __iter__(self):
+        cycle = self.first_cycle
+        while True:
+            block = self.f.read(self.block_size)
+            if not block:
+                return
+            if len(block) % TraceFile.record_struct.size:
+                raise TraceFile.FormatError('truncated record')
+            for pc, ir, a, c, x, wval, y, waddr in TraceFile.record_struct.iter_unpack(block):
+                yield cycle, pc, ir, a, c, x, y, waddr, wval
+                cycle += 4
@@ -14,40 +14,75 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# The decoder samples the transmit line at oversampling times the bit
+# rate, like a hardware UART receiver, but only does work at line
+# transitions: the level is constant between calls to tx(), so the
+# samples in that interval are skipped over until the next one that
+# matters (a start bit while idle, or the middle of the next bit of a
+# frame).  Sample j is at cycle j * sample_period, kept as an exact
+# fraction so that long runs don't drift.
+#
+# UARTRx is the other direction, from a file to the simulated machine.
+
+from fractions import Fraction
+import os
+import queue
+import struct
+import sys
+import threading
+
+
 class UART:
 
+    # decoder state for checkpoints: line_state, idle, bit_num, byte_val,
+    # next_sample, frame_sample
+    state_struct = struct.Struct('<BBbHQQ')
+
     def __init__(self, clock_freq_hz, bit_rate_hz = 115200, data_bits = 8, stop_bits = 1, oversampling = 16):
-        self.bit_time_cycles = clock_freq_hz / bit_rate_hz
+        self.sample_period = Fraction(clock_freq_hz) / (Fraction(bit_rate_hz) * oversampling)
         self.data_bits = data_bits
         self.stop_bits = stop_bits
         self.oversampling = oversampling
+        self.framing_error = None  # if set, called after a framing error is reported
 
         self.line_state = 1
-        self.sample_cycle = 0
+        self.next_sample = 0   # first sample not yet taken
 
         self.idle = True
-        self.oversampling_counter = 0
+        self.frame_sample = 0  # when not idle, sample for the next bit
+        self.bit_num = -1
+        self.byte_val = 0x00
 
+    def get_state(self):
+        return self.state_struct.pack(self.line_state,
+                                      self.idle,
+                                      self.bit_num,
+                                      self.byte_val,
+                                      self.next_sample,
+                                      self.frame_sample)
 
-    def process_tx_sample(self, value):
-        if self.idle:
-            if value:
-                return	# still idle
-            # start bit
-            self.idle = False
-            self.bit_num = -1  # start bit
-            self.byte_val = 0x00
-            self.oversampling_counter = self.oversampling // 2
-            return
-        self.oversampling_counter -= 1
-        if self.oversampling_counter:
-            return
-        self.oversampling_counter = self.oversampling
+    def set_state(self, state):
+        (self.line_state,
+         idle,
+         self.bit_num,
+         self.byte_val,
+         self.next_sample,
+         self.frame_sample) = self.state_struct.unpack(state)
+        self.idle = bool(idle)
+
+
+    # Process the sample of a frame bit (start, data, or stop) taken at
+    # the middle of the bit time.  Framing errors are reported on stderr,
+    # apart from the received bytes, with the cycle of the line change
+    # that ended the bit.
+    def process_bit(self, value, cycle):
         if self.bit_num < 0:
             # check start bit
             if value:
-                print('framing error - start bit')
+                print('framing error - start bit, cycle %d' % cycle, file = sys.stderr)
                 self.idle = True
+                if self.framing_error is not None:
+                    self.framing_error()
                 return
             self.bit_num = 0
             return
@@ -56,25 +91,105 @@ class UART:
         if self.bit_num < (self.data_bits + self.stop_bits):
             return
         if (self.byte_val >> self.data_bits) != ((1 << self.stop_bits) - 1):
-            print('framing error - stop bit')
+            print('framing error - stop bit, cycle %d' % cycle, file = sys.stderr)
             self.idle = True
+            if self.framing_error is not None:
+                self.framing_error()
             return
         self.byte_val &= ((1 << self.data_bits) - 1)
         self.idle = True
         return self.byte_val
 
 
+    # Takes all samples up to and including cycle at the current line
+    # state, then changes the line state to value.  Returns the last
+    # byte received, if any.
     def tx(self, cycle, value):
         rxb = None
-        while self.sample_cycle <= cycle:
-            b = self.process_tx_sample(self.line_state)
+        level = self.line_state
+        last_sample = (cycle * self.sample_period.denominator) // self.sample_period.numerator
+        while self.next_sample <= last_sample:
+            if self.idle:
+                if level:
+                    self.next_sample = last_sample + 1  # still idle
+                    break
+                # start bit
+                self.idle = False
+                self.bit_num = -1  # start bit
+                self.byte_val = 0x00
+                self.frame_sample = self.next_sample + self.oversampling // 2
+                self.next_sample += 1
+                continue
+            if self.frame_sample > last_sample:
+                self.next_sample = last_sample + 1
+                break
+            self.next_sample = self.frame_sample + 1
+            self.frame_sample += self.oversampling
+            b = self.process_bit(level, cycle)
             if b is not None:
                 rxb = b
-            self.sample_cycle += self.bit_time_cycles / self.oversampling
         self.line_state = value
         return rxb
 
 
+# Transmits bytes from a file, pipe or terminal to the simulated
+# machine, as UART frames on an input line.  A reader thread moves the
+# bytes into a queue, so the simulator never blocks waiting for input;
+# while the line is idle, the queue is polled once per frame time.
+# Each frame is scheduled on the event queue as the level changes of
+# its bits, at their exact cycles.  set_line is called with each new
+# line level, 1 being idle.  The polls are periodic events; the level
+# changes of a frame are not, so a checkpoint can't be saved mid-frame.
+class UARTRx:
+
+    def __init__(self, events, set_line, clock_freq_hz, bit_rate_hz = 115200, data_bits = 8, stop_bits = 1):
+        self.events = events
+        self.set_line = set_line
+        self.bit_period = Fraction(clock_freq_hz) / Fraction(bit_rate_hz)
+        self.data_bits = data_bits
+        self.stop_bits = stop_bits
+        self.frame_cycles = self.bit_cycles(1 + data_bits + stop_bits)
+        self.queue = queue.Queue()
+        self.line = 1
+        set_line(1)
+
+    # cycles from the start of a frame to the start of bit i
+    def bit_cycles(self, i):
+        return -((-i * self.bit_period.numerator) // self.bit_period.denominator)
+
+    def reader(self, f):
+        fd = f.fileno()
+        while True:
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            for b in data:
+                self.queue.put(b)
+        self.queue.put(None)
 
+    # Starts reading f, and polling for input at cycle.
+    def start(self, f, cycle):
+        threading.Thread(target = self.reader, args = (f,), daemon = True).start()
+        self.events.schedule(cycle, self.poll, periodic = True)
 
-                
+    def change_line(self, value):
+        def change(cycle):
+            self.line = value
+            self.set_line(value)
+        return change
+
+    def poll(self, cycle):
+        try:
+            b = self.queue.get_nowait()
+        except queue.Empty:
+            self.events.schedule(cycle + self.frame_cycles, self.poll, periodic = True)
+            return
+        if b is None:
+            return  # end of input
+        bits = [0] + [(b >> i) & 1 for i in range(self.data_bits)] + [1] * self.stop_bits
+        level = 1
+        for i, bit in enumerate(bits):
+            if bit != level:
+                self.events.schedule(cycle + self.bit_cycles(i), self.change_line(bit))
+                level = bit
+        self.events.schedule(cycle + self.frame_cycles, self.poll, periodic = True)